@@ -0,0 +1,5 @@
+"""
+Benchmarks for each blagh stage against a synthetic corpus.
+
+Run: python -m benchmarks.run --sizes 1KB,10KB,100KB --baseline benchmarks/baseline.json
+"""
@@ -0,0 +1,97 @@
+"""
+Generates synthetic .blagh posts and html templates of a configurable shape.
+"""
+
+import random
+
+
+WORDS = (
+    'lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing',
+    'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore',
+)
+
+
+def parse_size(size):
+    """parses a size like '10KB' or '1MB' (or a plain int) into bytes"""
+    if isinstance(size, int):
+        return size
+
+    size = size.strip().upper()
+    for suffix, multiplier in (('MB', 1024 * 1024), ('KB', 1024), ('B', 1)):
+        if size.endswith(suffix):
+            return int(float(size[:-len(suffix)]) * multiplier)
+
+    return int(size)
+
+
+def generate_macros(depth):
+    """
+    macro_0 wraps its data in a <p>, and every macro_n wraps macro_n-1,
+    so using macro_{depth-1} expands through depth levels of macros
+    """
+    lines = ['  $macro_0$ := <p class="m0">{}</p>']
+    for i in range(1, depth):
+        lines.append('  $macro_{i}$ := <div class="m{i}"><macro_{prev}>{{}}</macro_{prev}></div>'.format(i=i, prev=i - 1))
+
+    return '\n'.join(lines)
+
+
+def generate_paragraph(rng, words, variables, variable_density):
+    """a paragraph of words where roughly variable_density of them are $variables$"""
+    out = []
+    for _ in range(words):
+        if variables and rng.random() < variable_density:
+            out.append('$v{n}$'.format(n=rng.randrange(variables)))
+        else:
+            out.append(rng.choice(WORDS))
+
+    return ' '.join(out)
+
+
+def generate_post(size='10KB', tags=4, variables=20, variable_density=0.05, macro_depth=2, seed=0):
+    """
+    Returns the source of a .blagh post of roughly size bytes, with tags
+    custom content tags, variables $variables$ used at variable_density,
+    and a chain of macro_depth nested macros.
+    """
+    rng = random.Random(seed)
+    target = parse_size(size)
+    macro_depth = max(macro_depth, 1)
+    top_macro = 'macro_{n}'.format(n=macro_depth - 1)
+
+    header = [
+        '<globals>',
+        '  $title$ := Synthetic Post {seed}'.format(seed=seed),
+        '  $author$ := Benchmark',
+        '</globals>',
+        '',
+        '<variables>',
+    ]
+    header += ['  $v{n}$ := value-{n}'.format(n=n) for n in range(variables)]
+    header += ['</variables>', '', '<macros>', generate_macros(macro_depth), '</macros>', '']
+    src = '\n'.join(header)
+
+    budget = max(target - len(src), 0)
+    per_tag = max(budget // max(tags, 1), 1)
+
+    sections = []
+    for t in range(tags):
+        paragraphs = []
+        length = 0
+        while length < per_tag:
+            paragraph = '  <{m}>{text}</{m}>'.format(m=top_macro, text=generate_paragraph(rng, 40, variables, variable_density))
+            paragraphs.append(paragraph)
+            length += len(paragraph) + 1
+
+        sections.append('<tag{t}>\n{body}\n</tag{t}>\n'.format(t=t, body='\n'.join(paragraphs)))
+
+    return src + '\n'.join(sections)
+
+
+def generate_template(tags=4):
+    """an html template with $title$, $author$, and one slot per content tag"""
+    slots = '\n'.join('    <section>$tag{t}$</section>'.format(t=t) for t in range(tags))
+    return (
+        '<!DOCTYPE html>\n<html>\n  <head>\n    <title>$title$ - $author$</title>\n  </head>\n'
+        '  <body>\n{slots}\n  </body>\n</html>\n'
+    ).format(slots=slots)
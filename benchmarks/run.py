@@ -0,0 +1,185 @@
+"""
+Times each blagh stage over synthetic posts of increasing size and emits
+the results as JSON. With --baseline, exits non-zero when any stage is
+slower than its stored baseline by more than --threshold.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+from blagh import lexer, parser, expansion, compiler, tool
+from blagh.metadata import __version__
+
+from benchmarks import corpus
+
+
+DEFAULT_SIZES = '1KB,10KB,100KB'
+DEFAULT_MIN_TIME = 0.2
+STAGES = ('lex', 'parse', 'expand', 'compile', 'end_to_end')
+
+
+def per_call(fn, setup=None, min_time=DEFAULT_MIN_TIME):
+    """
+    fn's time per call. Like timeit's autorange, fn is called (on an
+    untimed setup()'s result) until at least min_time has been spent in
+    it, so stages that take microseconds are timed over many calls rather
+    than once. As in timeit, the garbage collector is off while timing.
+    """
+    calls = 0
+    elapsed = 0.0
+    while calls == 0 or elapsed < min_time:
+        arg = setup() if setup else None
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            fn(arg)
+            elapsed += time.perf_counter() - start
+        finally:
+            gc.enable()
+        calls += 1
+
+    return elapsed / calls
+
+
+def end_to_end_timer(src, template, workdir, min_time):
+    """times tool.main() on files written to workdir"""
+    os.makedirs(workdir)
+    post_path = os.path.join(workdir, 'post.blagh')
+    template_path = os.path.join(workdir, 'template.html')
+    with open(post_path, 'w') as f:
+        f.write(src)
+    with open(template_path, 'w') as f:
+        f.write(template)
+
+    def clean():
+        shutil.rmtree(tool.sluggify(post_path), ignore_errors=True)
+
+    return lambda: per_call(lambda _: tool.main(['-f', post_path, '-t', template_path, '--no-cache']), clean, min_time)
+
+
+def stage_timers(size, options, workdir):
+    """(bytes, { stage: timer }) for the selected stages against one generated post; each timer takes one measurement"""
+    src = corpus.generate_post(size, tags=options.tags, variables=options.variables,
+                               variable_density=options.variable_density, macro_depth=options.macro_depth)
+    template = corpus.generate_template(options.tags)
+    min_time = options.min_time
+    selected = [ stage for stage in STAGES if stage in options.stages ]
+
+    expanded = expansion.expand(parser.parse(lexer.scan(src))) if 'compile' in selected else None
+    timers = {
+        'lex': lambda: per_call(lambda _: lexer.scan(src), None, min_time),
+        'parse': lambda: per_call(parser.parse, lambda: lexer.scan(src), min_time),
+        'expand': lambda: per_call(expansion.expand, lambda: parser.parse(lexer.scan(src)), min_time),
+        'compile': lambda: per_call(lambda _: compiler.compile(expanded, template), None, min_time),
+    }
+    if 'end_to_end' in selected:
+        timers['end_to_end'] = end_to_end_timer(src, template, os.path.join(workdir, size), min_time)
+
+    return len(src), { stage: timers[stage] for stage in selected }
+
+
+def bench(options):
+    """
+    times the selected stages at every size, returning a list of result
+    dicts. Each stage keeps its fastest of options.repeat measurements,
+    and the measurements are taken in rounds across every stage and size,
+    so a slow spell on a shared machine costs each stage one measurement
+    rather than all of its measurements.
+    """
+    workdir = tempfile.mkdtemp(prefix='blagh-bench-')
+    try:
+        timers = []
+        for size in options.sizes:
+            length, timed = stage_timers(size, options, workdir)
+            timers += [ (stage, size, length, timer) for stage, timer in timed.items() ]
+
+        best = {}
+        for _ in range(options.repeat):
+            for stage, size, _, timer in timers:
+                seconds = timer()
+                best[stage, size] = min(best.get((stage, size), seconds), seconds)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return [
+        {
+            'stage': stage,
+            'size': size,
+            'bytes': length,
+            'seconds': best[stage, size],
+            'mb_per_s': length / best[stage, size] / (1024 * 1024) if best[stage, size] else None,
+        }
+        for stage, size, length, _ in timers
+    ]
+
+
+def compare(results, baseline, threshold):
+    """returns the results that are slower than their baseline by more than threshold"""
+    expected = { (r['stage'], r['size']): r['seconds'] for r in baseline.get('results', []) }
+    regressions = []
+
+    for result in results:
+        key = (result['stage'], result['size'])
+        if key in expected and result['seconds'] > expected[key] * (1 + threshold):
+            regressions.append(dict(result, baseline=expected[key]))
+
+    return regressions
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark each blagh stage')
+
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated post sizes, eg 1KB,1MB,10MB")
+    parser.add_argument("--stages", default=','.join(STAGES), help="comma-separated stages to time")
+    parser.add_argument("--tags", type=int, default=4, help="custom content tags per post")
+    parser.add_argument("--variables", type=int, default=20, help="variables defined per post")
+    parser.add_argument("--variable-density", type=float, default=0.05, help="fraction of words that are variables")
+    parser.add_argument("--macro-depth", type=int, default=2, help="depth of nested macros")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements per stage, taken in rounds (fastest is kept)")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="seconds each measurement runs a stage for, at least")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown over baseline, eg 0.25 = 25%%")
+
+    args = parser.parse_args(argv)
+    args.sizes = [s for s in args.sizes.split(',') if s]
+    args.stages = [s for s in args.stages.split(',') if s]
+    return args
+
+
+def main(argv=None):
+    options = parse_arguments(argv)
+
+    results = bench(options)
+
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+    regressions = []
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(results, json.load(f), options.threshold)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
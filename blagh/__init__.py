@@ -0,0 +1,11 @@
+from blagh.engine import Engine
+
+
+def __getattr__(name):
+    # imported on first use: blagh.build is built on blagh.tool, which
+    # must not already be loaded when run as `python -m blagh.tool`
+    if name == 'build_async':
+        from blagh.build import build_async
+        return build_async
+
+    raise AttributeError('module {module!r} has no attribute {name!r}'.format(module=__name__, name=name))
@@ -0,0 +1,456 @@
+"""
+Builds a whole site: every .blagh file under a source directory,
+compiled against one template into <out-dir>/<slug>/index.html.
+
+Usage: blagh build <src-dir> -t <template> -o <out-dir> [-j <jobs>] [--incremental] [--async] [--listings] [--search] [--minify] [--gzip]
+
+Posts are rendered across a process pool. Each worker loads the
+template once, and its import resolver parses shared imports once.
+Files with no custom content tags (eg a shared macros.blagh) are only
+imported, so they are skipped. A failing post is reported in the
+summary rather than aborting the build. A post's slug is its path with
+the file name lowercased and dash-delimited, so posts whose slugs
+collide (eg My Post.blagh and my post.blagh) both fail.
+
+Every build writes a manifest to <out-dir>/.blagh-manifest.json that
+maps each post's output directory to the content hashes of its inputs
+(the post, the template and everything it imports), the tool version
+and the post-processing options. With --incremental, posts whose
+inputs are all unchanged are not rebuilt. Each build also updates the
+post index (see catalog), and with --listings renders the index, archive
+and feed pages from it. With --search, it also updates the site's search
+index (see search).
+
+With --minify, workers collapse each page's whitespace before writing it,
+and with --gzip they also write a precompressed index.html.gz beside it.
+
+build_async() is the same build as a coroutine: reads and writes run on
+a thread pool while rendering runs on the process pool, so different
+posts' reads, renders and writes overlap. iter_build_async() yields each
+post's result as it finishes, and holds at most max_pending posts at
+once, in flight or finished but not yet consumed.
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import asyncio
+import argparse
+import logging
+import tempfile
+import concurrent.futures
+
+from blagh import tool, lexer, parser, imports, expansion, cache, output, catalog
+from blagh.search import SearchIndex, count_terms
+from blagh.metadata import __version__
+
+
+logger = logging.getLogger('Build')
+
+
+EXTENSION = '.blagh'
+MANIFEST = '.blagh-manifest.json'
+DEFAULT_IO_WORKERS = 8
+
+# per-process state set up by init_worker()
+WORKER = {
+    'template': None,
+    'template_path': None,
+    'artifacts': None,
+    'writer': None,
+    'search': False,
+    'minify': False,
+}
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def find_posts(src_dir):
+    """every .blagh file under src_dir, in a stable order"""
+    posts = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        posts += [ os.path.join(root, f) for f in sorted(files) if f.endswith(EXTENSION) ]
+
+    return posts
+
+
+def post_slug(src_dir, post):
+    """the post's path relative to src-dir, with its file name (minus the extension) lowercased and dash-delimited"""
+    dirname, filename = os.path.split(os.path.relpath(post, src_dir))
+    return os.path.join(dirname, re.sub(r'\s+', '-', filename[:-len(EXTENSION)].lower()))
+
+
+def output_dir(src_dir, post, out_dir):
+    """<out-dir>/<slug of the post's path relative to src-dir>"""
+    return os.path.join(out_dir, post_slug(src_dir, post))
+
+
+def collisions(src_dir, posts, out_dir):
+    """{ post: error } for every post whose output directory another post also builds into"""
+    claimed = {}
+    for post in posts:
+        claimed.setdefault(output_dir(src_dir, post, out_dir), []).append(post)
+
+    return {
+        post: 'Exception: output directory {dirname} is shared by {posts}'.format(dirname=dirname, posts=', '.join(shared))
+        for dirname, shared in claimed.items() if len(shared) > 1 for post in shared
+    }
+
+
+def load_manifest(out_dir, options=None):
+    """the previous build's manifest entries, or {} if missing or from another tool version or options"""
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('version') != __version__ or manifest.get('options', {}) != (options or {}):
+        return {}
+
+    return manifest.get('outputs', {})
+
+
+def write_manifest(out_dir, outputs, options=None):
+    """atomically replaces the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=out_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({ 'version': __version__, 'options': options or {}, 'outputs': outputs }, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+
+
+def hash_inputs(paths, memo):
+    """{ path: content hash } for paths (None for missing files), memoized across posts"""
+    hashes = {}
+    for path in paths:
+        if path not in memo:
+            try:
+                memo[path] = cache.hash_file(path)
+            except OSError:
+                memo[path] = None
+        hashes[path] = memo[path]
+
+    return hashes
+
+
+def is_unchanged(entry, dirname, memo):
+    """True if a manifest entry's inputs all hash the same and its output is still there"""
+    if entry is None:
+        return False
+    if entry['status'] == 'built' and not os.path.exists(os.path.join(dirname, 'index.html')):
+        return False
+
+    return hash_inputs(entry['inputs'], memo) == entry['inputs']
+
+
+def init_worker(template_path, artifacts, search=False, minify=False, compress=False):
+    """
+    loads the template once per worker process. with search, results
+    carry each post's terms; minify and compress post-process its pages.
+    if the template fails to load, the worker keeps its previous one
+    """
+    template = tool.load_template(template_path, artifacts)
+    WORKER['search'] = search
+    WORKER['minify'] = minify
+    WORKER['artifacts'] = artifacts
+    WORKER['template_path'] = os.path.abspath(template_path)
+    WORKER['template'] = template
+    WORKER['writer'] = output.Writer(compress)
+
+
+def build_post(post, dirname):
+    """
+    renders one post into dirname/index.html, returning a result dict
+    with its status ('built', 'skipped' or 'failed') and any error
+    """
+    result = { 'post': post, 'output': dirname, 'status': 'built', 'error': None, 'inputs': None, 'written': False, 'globals': None, 'terms': None }
+
+    try:
+        expanded = tool.load_post(post, WORKER['artifacts'])
+        result['globals'] = expanded.globals
+        if WORKER['search']:
+            result['terms'] = count_terms(expanded.custom_tags)
+
+        path = os.path.abspath(post)
+        dependencies = imports.dependencies(expanded, os.path.dirname(path), path)
+        inputs = [path, WORKER['template_path']] + [ p for p, _ in dependencies ]
+        result['inputs'] = hash_inputs(inputs, {})
+
+        if not expanded.custom_tags:
+            result['status'] = 'skipped'
+            return result
+
+        path = os.path.join(dirname, 'index.html')
+        if WORKER['minify']:
+            result['written'] = tool.write_file(path, output.minify(WORKER['template'].render(expanded)), WORKER['writer'])
+        else:
+            result['written'] = tool.stream_file(path, WORKER['template'], expanded, WORKER['writer'])
+    except Exception as e:
+        logger.info('build_post() -> %s failed: %s', post, e)
+        result['status'] = 'failed'
+        result['error'] = '{kind}: {error}'.format(kind=type(e).__name__, error=e)
+
+    return result
+
+
+def build(src_dir, template_path, out_dir, jobs=None, artifacts=None, incremental=False, search=False, minify=False, compress=False):
+    """
+    builds every post under src_dir, returning their result dicts in
+    post order. with incremental, unchanged posts are not rebuilt; with
+    search, the search index is updated too. minify collapses each page's
+    whitespace, and compress writes a .gz beside it.
+    """
+    posts = find_posts(src_dir)
+    jobs = jobs or available_cores()
+    options = { 'minify': minify, 'compress': compress }
+    manifest = load_manifest(out_dir, options) if incremental else {}
+    memo = {}
+    clashes = collisions(src_dir, posts, out_dir)
+
+    results = []
+    work = []
+    for post in posts:
+        dirname = output_dir(src_dir, post, out_dir)
+        entry = manifest.get(os.path.relpath(dirname, out_dir))
+        if post in clashes:
+            results.append({ 'post': post, 'output': dirname, 'status': 'failed', 'error': clashes[post], 'inputs': None, 'written': False, 'globals': None, 'terms': None })
+        elif incremental and is_unchanged(entry, dirname, memo):
+            results.append({ 'post': post, 'output': dirname, 'status': 'unchanged', 'error': None, 'inputs': entry['inputs'], 'written': False, 'globals': None, 'terms': None, 'previous': entry['status'] })
+        else:
+            results.append(None)
+            work.append((len(results) - 1, post, dirname))
+
+    if jobs == 1 or len(work) < 2:
+        init_worker(template_path, artifacts, search, minify, compress)
+        for i, post, dirname in work:
+            results[i] = build_post(post, dirname)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(template_path, artifacts, search, minify, compress)) as executor:
+            futures = [ (i, executor.submit(build_post, post, dirname)) for i, post, dirname in work ]
+            for i, future in futures:
+                results[i] = future.result()
+
+    finish(out_dir, results, search, options)
+    return results
+
+
+def is_skipped(result):
+    """True for a post with no content tags, whether skipped now or (if unchanged) last time"""
+    return result['status'] == 'skipped' or result.get('previous') == 'skipped'
+
+
+def finish(out_dir, results, search=False, options=None):
+    """records a build's results in the manifest, the post index and (optionally) the search index"""
+    write_manifest(out_dir, {
+        os.path.relpath(r['output'], out_dir): { 'post': r['post'], 'status': 'skipped' if is_skipped(r) else 'built', 'inputs': r['inputs'] }
+        for r in results if r['status'] != 'failed'
+    }, options)
+
+    with catalog.Catalog.open(out_dir) as index:
+        index.update(results, out_dir)
+
+    if search:
+        SearchIndex(out_dir).update(results)
+
+
+def read_post(post):
+    """a post's (source, content hash), read on an io thread"""
+    return tool.load_file(post), cache.hash_file(post)
+
+
+def render_source(post, source, digest):
+    """
+    expands an already-read post and renders it with the worker's
+    template, returning (html, input hashes, globals, terms); html is None
+    for a post with no custom content tags, and terms None unless the
+    worker indexes for search
+    """
+    path = os.path.abspath(post)
+    base_dir = os.path.dirname(path)
+    artifacts = WORKER['artifacts']
+
+    expanded = artifacts.load_post(post, digest) if artifacts is not None else None
+    if expanded is None:
+        expanded = expansion.expand(imports.resolve(parser.parse(lexer.scan_stream(io.StringIO(source))), base_dir, path))
+        if artifacts is not None:
+            artifacts.store_post(post, digest, expanded, imports.dependencies(expanded, base_dir, path))
+
+    dependencies = imports.dependencies(expanded, base_dir, path)
+    inputs = { path: digest }
+    inputs.update(hash_inputs([WORKER['template_path']] + [ p for p, _ in dependencies ], {}))
+
+    terms = count_terms(expanded.custom_tags) if WORKER['search'] else None
+    if not expanded.custom_tags:
+        return None, inputs, expanded.globals, terms
+
+    html = WORKER['template'].render(expanded)
+    if WORKER['minify']:
+        html = output.minify(html)
+
+    return html, inputs, expanded.globals, terms
+
+
+async def build_post_async(loop, threads, pool, writer, post, dirname):
+    """build_post(), reading and writing on a thread pool and rendering on the process pool"""
+    result = { 'post': post, 'output': dirname, 'status': 'built', 'error': None, 'inputs': None, 'written': False, 'globals': None, 'terms': None }
+
+    try:
+        source, digest = await loop.run_in_executor(threads, read_post, post)
+        html, result['inputs'], result['globals'], result['terms'] = await loop.run_in_executor(pool, render_source, post, source, digest)
+
+        if html is None:
+            result['status'] = 'skipped'
+            return result
+
+        result['written'] = await loop.run_in_executor(threads, writer.write_text, os.path.join(dirname, 'index.html'), html)
+    except Exception as e:
+        logger.info('build_post_async() -> %s failed: %s', post, e)
+        result['status'] = 'failed'
+        result['error'] = '{kind}: {error}'.format(kind=type(e).__name__, error=e)
+
+    return result
+
+
+async def iter_build_async(src_dir, template_path, out_dir, jobs=None, artifacts=None, incremental=False,
+                           io_workers=DEFAULT_IO_WORKERS, max_pending=None, search=False, minify=False, compress=False):
+    """
+    builds every post under src_dir like build(), yielding each result
+    dict as soon as its post finishes. At most max_pending posts (default
+    twice the jobs) are read, rendered or waiting to be consumed at once.
+    The manifest and index are written once every post has been yielded; closing or
+    cancelling the iteration early cancels the posts still in flight.
+    Pages are minified on the process pool, and gzipped as they are
+    written on the thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    jobs = jobs or available_cores()
+    max_pending = max_pending or 2 * jobs
+
+    threads = concurrent.futures.ThreadPoolExecutor(max_workers=io_workers)
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(template_path, artifacts, search, minify))
+    writer = output.Writer(compress)
+    tasks = []
+
+    try:
+        posts = await loop.run_in_executor(threads, find_posts, src_dir)
+        options = { 'minify': minify, 'compress': compress }
+        manifest = await loop.run_in_executor(threads, load_manifest, out_dir, options) if incremental else {}
+        memo = {}
+        clashes = collisions(src_dir, posts, out_dir)
+
+        pending = asyncio.Queue()
+        for post in posts:
+            pending.put_nowait(post)
+        finished = asyncio.Queue()
+
+        # one slot per post being read, rendered or written, or finished but not yet consumed
+        slots = asyncio.Semaphore(max_pending)
+
+        async def run():
+            while True:
+                await slots.acquire()
+                if pending.empty():
+                    slots.release()
+                    return
+                post = pending.get_nowait()
+                dirname = output_dir(src_dir, post, out_dir)
+                entry = manifest.get(os.path.relpath(dirname, out_dir))
+                if post in clashes:
+                    result = { 'post': post, 'output': dirname, 'status': 'failed', 'error': clashes[post], 'inputs': None, 'written': False, 'globals': None, 'terms': None }
+                elif incremental and await loop.run_in_executor(threads, is_unchanged, entry, dirname, memo):
+                    result = { 'post': post, 'output': dirname, 'status': 'unchanged', 'error': None, 'inputs': entry['inputs'], 'written': False, 'globals': None, 'terms': None, 'previous': entry['status'] }
+                else:
+                    result = await build_post_async(loop, threads, pool, writer, post, dirname)
+                finished.put_nowait(result)
+
+        tasks = [ asyncio.ensure_future(run()) for _ in range(min(max_pending, len(posts))) ]
+
+        results = []
+        for _ in posts:
+            result = await finished.get()
+            slots.release()
+            results.append(result)
+            yield result
+
+        await loop.run_in_executor(threads, finish, out_dir, results, search, options)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        threads.shutdown(wait=False, cancel_futures=True)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def build_async(src_dir, template_path, out_dir, jobs=None, artifacts=None, incremental=False,
+                      io_workers=DEFAULT_IO_WORKERS, max_pending=None, search=False, minify=False, compress=False):
+    """build() as a coroutine, returning the result dicts in the order their posts finished"""
+    return [ result async for result in iter_build_async(src_dir, template_path, out_dir, jobs, artifacts, incremental, io_workers, max_pending, search, minify, compress) ]
+
+
+def summarize(results):
+    """a human-readable summary: counts, then one line per failure"""
+    counts = { 'built': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0 }
+    for result in results:
+        counts[result['status']] += 1
+
+    written = sum(1 for r in results if r['written'])
+    lines = [ 'built {built}, unchanged {unchanged}, skipped {skipped}, failed {failed}'.format(**counts) ]
+    lines[0] += ' ({written} files written, {identical} identical to disk)'.format(written=written, identical=counts['built'] - written)
+    lines += [ '  {post}: {error}'.format(**r) for r in results if r['status'] == 'failed' ]
+    return '\n'.join(lines)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="blagh build", description="compile every .blagh file under a directory")
+
+    parser.add_argument("src_dir", help="the directory of .blagh files to compile")
+    parser.add_argument("-t", "--template", help="the template to compile each file against", required=True)
+    parser.add_argument("-o", "--out", help="the directory to write posts to", required=True)
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: available cores)")
+    parser.add_argument("--incremental", action="store_true", help="skip posts whose inputs have not changed since the last build")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="overlap reads and writes with rendering on an event loop")
+    parser.add_argument("--listings", action="store_true", help="also write the index, archive and feed pages from the post index")
+    parser.add_argument("--listing-template", help="a template with $title$, $posts$ and $pagination$ slots for the listing pages")
+    parser.add_argument("--base-url", default="/", help="the url the site is served from, for links and the feed")
+    parser.add_argument("--site-title", default="Posts", help="the title of the listing pages and feed")
+    parser.add_argument("--per-page", type=int, default=catalog.DEFAULT_PER_PAGE, help="posts per index page")
+    parser.add_argument("--search", action="store_true", help="also update the sharded search index under <out-dir>/search/")
+    parser.add_argument("--minify", action="store_true", help="collapse whitespace outside <pre>, <textarea> and <script>")
+    parser.add_argument("--gzip", action="store_true", help="also write a precompressed .gz beside every page")
+    tool.add_common_arguments(parser)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    parsed_args = parse_arguments(argv)
+    artifacts = tool.configure(parsed_args)
+
+    arguments = (parsed_args.src_dir, parsed_args.template, parsed_args.out, parsed_args.jobs, artifacts, parsed_args.incremental)
+    options = { 'search': parsed_args.search, 'minify': parsed_args.minify, 'compress': parsed_args.gzip }
+    if parsed_args.use_async:
+        results = asyncio.run(build_async(*arguments, **options))
+    else:
+        results = build(*arguments, **options)
+    print(summarize(results))
+
+    if parsed_args.listings:
+        template = tool.load_template(parsed_args.listing_template, artifacts) if parsed_args.listing_template else None
+        with catalog.Catalog.open(parsed_args.out) as index:
+            try:
+                catalog.generate(index, parsed_args.out, parsed_args.base_url, parsed_args.site_title, parsed_args.per_page, template=template)
+            except Exception as e:
+                print(e, file=sys.stderr)
+                return 1
+
+    return 1 if any(r['status'] == 'failed' for r in results) else 0
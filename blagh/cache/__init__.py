@@ -0,0 +1,210 @@
+"""
+On-disk cache of compiled artifacts (.blaghc files).
+
+A post's artifact is its expanded Document plus the hashes of the files
+it imports; a template's artifact is its CompiledTemplate segments.
+Artifacts are keyed by content hash and tool version, and the cache
+directory is capped in size, evicting the least recently used first.
+
+artifact := MAGIC + zlib(json(payload))
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+import tempfile
+
+from blagh import imports, compiler
+from blagh.parser import Document
+from blagh.metadata import __version__
+
+
+logger = logging.getLogger('Cache')
+
+
+MAGIC = b'BLAGHC1\n'
+EXTENSION = '.blaghc'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def default_directory():
+    """$BLAGH_CACHE_DIR, else $XDG_CACHE_HOME/blagh, else ~/.cache/blagh"""
+    if os.environ.get('BLAGH_CACHE_DIR'):
+        return os.environ['BLAGH_CACHE_DIR']
+
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'blagh')
+
+
+def hash_file(path):
+    """sha256 of a file's bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def dumps(payload):
+    return MAGIC + zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+
+def loads(data):
+    if not data.startswith(MAGIC):
+        raise Exception('Not a .blaghc artifact')
+
+    return json.loads(zlib.decompress(data[len(MAGIC):]).decode('utf-8'))
+
+
+def document_to_dict(doc):
+    return { key: doc[key] for key in Document.__slots__ }
+
+
+def document_from_dict(payload):
+    payload['locations'] = { k: tuple(v) for k, v in payload['locations'].items() }
+    return Document(**payload)
+
+
+class ArtifactCache(object):
+    """
+    a directory of .blaghc artifacts, capped at max_bytes. The directory
+    is scanned once to learn its size, which is then kept as a running
+    total, so it is only rescanned when a put takes it over the cap.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.size = None
+
+    def path_for(self, kind, *parts):
+        """artifact path for a kind ('post' or 'template') and the hashes/paths identifying it"""
+        key = hashlib.sha256('\0'.join((__version__, kind) + parts).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def get(self, path):
+        """returns an artifact's payload (marking it recently used), or None"""
+        try:
+            with open(path, 'rb') as f:
+                payload = loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('get() -> discarding unreadable artifact %s: %s', path, e)
+            self.remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return payload
+
+    def put(self, path, payload):
+        """atomically writes an artifact, then evicts down to max_bytes if it is over"""
+        os.makedirs(self.directory, exist_ok=True)
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.artifacts())
+
+        data = dumps(payload)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            self.remove(tmp)
+            raise
+
+        self.size += len(data) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def artifacts(self):
+        """(mtime, size, path) for every artifact in the directory"""
+        artifacts = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return artifacts
+
+        for entry in entries:
+            if entry.name.endswith(EXTENSION):
+                # another process may evict (or replace) the same artifact concurrently
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return artifacts
+
+    def evict(self):
+        """removes least recently used artifacts until the cache fits in max_bytes"""
+        artifacts = self.artifacts()
+
+        total = sum(size for _, size, _ in artifacts)
+        for _, size, path in sorted(artifacts):
+            if total <= self.max_bytes:
+                break
+            logger.info('evict() -> removing %s', path)
+            self.remove(path)
+            total -= size
+
+        # the rescan also picks up what other processes sharing the directory wrote
+        self.size = total
+
+    def post_path(self, filename, digest):
+        # imports resolve relative to the post, so its directory is part of the key
+        return self.path_for('post', digest, os.path.dirname(os.path.abspath(filename)))
+
+    def load_post(self, filename, digest):
+        """returns the cached expanded Document for a post, if neither it nor its imports changed"""
+        payload = self.get(self.post_path(filename, digest))
+        if payload is None:
+            return None
+
+        for path, expected in payload['dependencies']:
+            try:
+                with open(path) as f:
+                    current = imports.digest(f.read())
+            except OSError:
+                return None
+            if current != expected:
+                return None
+
+        return document_from_dict(payload['document'])
+
+    def store_post(self, filename, digest, doc, dependencies):
+        self.put(self.post_path(filename, digest), {
+            'document': document_to_dict(doc),
+            'dependencies': [ list(d) for d in dependencies ],
+        })
+
+    def template_path(self, digest):
+        # segments depend on how slots are found, so the slot pattern is part of the key
+        return self.path_for('template', digest, compiler.SLOT.pattern)
+
+    def load_template(self, digest):
+        """returns a template's cached segments, or None"""
+        payload = self.get(self.template_path(digest))
+        return None if payload is None else payload['segments']
+
+    def store_template(self, digest, segments):
+        self.put(self.template_path(digest), { 'segments': segments })
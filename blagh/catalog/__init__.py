@@ -0,0 +1,261 @@
+"""
+A SQLite index of every built post's globals, for listing pages.
+
+Each build records the globals, slug and content hash of every post in
+<out-dir>/.blagh-index.db, rewriting only the rows of posts that were
+rebuilt. Index, pagination, archive and feed pages are then rendered
+from queries against it, so they never re-lex or re-parse a post.
+
+slug := the post's output directory, relative to <out-dir>
+"""
+
+import os
+import json
+import html
+import time
+import sqlite3
+import logging
+
+from blagh import tool, compiler, output
+
+
+logger = logging.getLogger('Catalog')
+
+
+DATABASE = '.blagh-index.db'
+SCHEMA_VERSION = 2
+
+DEFAULT_PER_PAGE = 10
+DEFAULT_FEED_SIZE = 20
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS posts (
+    slug TEXT PRIMARY KEY,
+    post TEXT NOT NULL,
+    hash TEXT,
+    title TEXT,
+    date TEXT,
+    summary TEXT,
+    indexed TEXT NOT NULL,
+    globals TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_by_date ON posts (date DESC, slug);
+'''
+
+# newest first; undated posts last, by slug
+ORDER = 'ORDER BY date IS NULL, date DESC, slug'
+
+# listing pages live under these top level paths, so no post may be built there
+RESERVED = ('page', 'archive', 'feed.xml', 'index.html')
+
+# $title$, $posts$ and $pagination$ are filled in for every listing page
+LISTING_TEMPLATE = '<!DOCTYPE html><html><head><meta charset="utf-8"><title>$title$</title></head><body><h1>$title$</h1>$posts$$pagination$</body></html>'
+
+
+def timestamp():
+    """the current time, as an Atom (RFC 3339) timestamp"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def barename(name):
+    """$title$ -> title"""
+    return name.strip('$')
+
+
+class Catalog(object):
+    """the post index at path, created (or reset, if from another schema) on open"""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS posts')
+            self.connection.execute('PRAGMA user_version = {version}'.format(version=SCHEMA_VERSION))
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        return cls(os.path.join(out_dir, DATABASE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def slugs(self):
+        return { row['slug'] for row in self.connection.execute('SELECT slug FROM posts') }
+
+    def put(self, slug, post, digest, globals):
+        names = { barename(k): v for k, v in globals.items() }
+        # a rebuild that changes nothing keeps the post's indexed time, so the feed stays put
+        self.connection.execute(
+            'INSERT INTO posts (slug, post, hash, title, date, summary, indexed, globals) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(slug) DO UPDATE SET post = excluded.post, hash = excluded.hash, title = excluded.title, date = excluded.date, summary = excluded.summary, '
+            'indexed = CASE WHEN hash IS excluded.hash AND globals = excluded.globals THEN indexed ELSE excluded.indexed END, globals = excluded.globals',
+            (slug, post, digest, names.get('title'), names.get('date'), names.get('summary', names.get('description')), timestamp(), json.dumps(names, sort_keys=True)))
+
+    def update(self, results, out_dir):
+        """
+        applies a build's result dicts: rebuilt posts are rewritten, posts
+        no longer built (deleted, or with no content tags) are removed, and
+        failed or unchanged posts keep their rows. An unchanged post missing
+        from the index (eg the index was deleted) is parsed once to add it.
+        """
+        with self.connection:
+            indexed = self.slugs()
+            keep = set()
+
+            for result in results:
+                if result['status'] == 'skipped' or result.get('previous') == 'skipped':
+                    continue
+
+                slug = os.path.relpath(result['output'], out_dir)
+                if result['status'] == 'built' or (result['status'] == 'unchanged' and slug not in indexed):
+                    globals = result.get('globals')
+                    if globals is None:
+                        globals = tool.load_post(result['post']).globals
+                    self.put(slug, result['post'], (result['inputs'] or {}).get(os.path.abspath(result['post'])), globals)
+                keep.add(slug)
+
+            stale = indexed - keep
+            self.connection.executemany('DELETE FROM posts WHERE slug = ?', [ (slug,) for slug in stale ])
+
+        logger.info('update() -> %d posts indexed, %d removed', len(keep), len(stale))
+
+    def collisions(self):
+        """slugs of posts built where a listing page would be written"""
+        return sorted(slug for slug in self.slugs() if slug.split(os.sep)[0] in RESERVED)
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+
+    def posts(self, limit=-1, offset=0):
+        """post rows, newest first"""
+        return self.connection.execute('SELECT * FROM posts ' + ORDER + ' LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+
+
+def post_url(base_url, slug):
+    return base_url.rstrip('/') + '/' + slug.replace(os.sep, '/') + '/'
+
+
+def page_path(out_dir, number):
+    """out_dir/index.html for page 1, out_dir/page/<n>/index.html after"""
+    if number == 1:
+        return os.path.join(out_dir, 'index.html')
+
+    return os.path.join(out_dir, 'page', str(number), 'index.html')
+
+
+def render_list(rows, base_url):
+    items = []
+    for row in rows:
+        # globals are html, exactly as they are injected into posts
+        date = '<time>{date}</time> '.format(date=row['date']) if row['date'] else ''
+        items.append('<li>{date}<a href="{url}">{title}</a></li>'.format(
+            date=date, url=html.escape(post_url(base_url, row['slug'])), title=row['title'] or html.escape(row['slug'])))
+
+    return '<ul>' + ''.join(items) + '</ul>'
+
+
+def render_pagination(number, pages, base_url):
+    links = []
+    if number > 1:
+        links.append('<a rel="prev" href="{url}">Newer</a>'.format(url=html.escape(page_url(base_url, number - 1))))
+    if number < pages:
+        links.append('<a rel="next" href="{url}">Older</a>'.format(url=html.escape(page_url(base_url, number + 1))))
+
+    return '<nav>' + ' '.join(links) + '</nav>' if links else ''
+
+
+def page_url(base_url, number):
+    if number == 1:
+        return base_url.rstrip('/') + '/'
+
+    return base_url.rstrip('/') + '/page/{number}/'.format(number=number)
+
+
+def atom_date(row):
+    """
+    an Atom timestamp for a row: its $date$ global (YYYY-MM-DD is taken
+    as midnight UTC), or when it was last indexed if it has no $date$
+    """
+    if not row['date']:
+        return row['indexed']
+
+    return row['date'] + 'T00:00:00Z' if len(row['date']) == 10 else row['date']
+
+
+def render_feed(rows, base_url, site_title):
+    """an Atom feed of rows"""
+    def text(value):
+        return html.escape(value or '', quote=False)
+
+    dates = [ atom_date(row) for row in rows ]
+    entries = []
+    for row in rows:
+        url = text(post_url(base_url, row['slug']))
+        entry = '<entry><title>{title}</title><link href="{url}"/><id>{url}</id>'.format(title=text(row['title'] or row['slug']), url=url)
+        entry += '<updated>{date}</updated>'.format(date=text(atom_date(row)))
+        if row['summary']:
+            entry += '<summary>{summary}</summary>'.format(summary=text(row['summary']))
+        entries.append(entry + '</entry>')
+
+    return ''.join([
+        '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">',
+        '<title>{title}</title><link href="{url}"/><id>{url}</id>'.format(title=text(site_title), url=text(page_url(base_url, 1))),
+        '<updated>{date}</updated>'.format(date=text(max(dates) if dates else timestamp())),
+        ''.join(entries),
+        '</feed>\n',
+    ])
+
+
+def generate(catalog, out_dir, base_url='/', site_title='Posts', per_page=DEFAULT_PER_PAGE,
+             feed_size=DEFAULT_FEED_SIZE, template=None, writer=None):
+    """
+    writes the paginated index, archive and Atom feed from catalog's rows,
+    through a CompiledTemplate with $title$, $posts$ and $pagination$
+    slots. returns the number of files written (unchanged files are not).
+    Fails, writing nothing, if a post was built where a listing page goes.
+    """
+    collisions = catalog.collisions()
+    if collisions:
+        raise Exception('Listing pages would overwrite the posts at {slugs}; rename them (the paths {reserved} are reserved)'.format(
+            slugs=', '.join(collisions), reserved=', '.join(RESERVED)))
+
+    template = template or compiler.CompiledTemplate(LISTING_TEMPLATE)
+    writer = writer or output.Writer()
+    written = 0
+
+    pages = max(1, -(-catalog.count() // per_page))
+    for number in range(1, pages + 1):
+        rows = catalog.posts(per_page, (number - 1) * per_page)
+        title = site_title if number == 1 else '{title} (page {number})'.format(title=site_title, number=number)
+        written += writer.write(page_path(out_dir, number), template.iter_values({
+            '$title$': html.escape(title),
+            '$posts$': render_list(rows, base_url),
+            '$pagination$': render_pagination(number, pages, base_url),
+        }))
+
+    # the archive groups every post by the year of its $date$
+    sections = []
+    for row in catalog.posts():
+        year = row['date'][:4] if row['date'] else 'Undated'
+        if not sections or sections[-1][0] != year:
+            sections.append((year, []))
+        sections[-1][1].append(row)
+
+    written += writer.write(os.path.join(out_dir, 'archive', 'index.html'), template.iter_values({
+        '$title$': html.escape(site_title + ' archive'),
+        '$posts$': ''.join('<h2>{year}</h2>{posts}'.format(year=html.escape(year), posts=render_list(rows, base_url)) for year, rows in sections),
+        '$pagination$': '',
+    }))
+
+    written += writer.write_text(os.path.join(out_dir, 'feed.xml'), render_feed(catalog.posts(feed_size), base_url, site_title))
+    return written
@@ -6,9 +6,98 @@ html file.
 import re
 import logging
 
+from blagh.parser import Document
+
 logger = logging.getLogger('Compiler')
 
 
+# a $name$ slot in a template; names are word characters and dashes, so a
+# stray $ (jQuery's $.get, US$5) never swallows the slots after it
+SLOT = re.compile(r'(\$[\w-]+\$)')
+
+
+def split_template(html):
+    """splits html once into [literal, $slot$, literal, ..., literal]"""
+    return SLOT.split(html)
+
+
+class CompiledTemplate(object):
+    """
+    An html template parsed once into literal segments and slots.
+    literals[i] precedes the slot named names[slots[i]], and the last
+    literal ends the template. Rendering fills every slot in one pass,
+    so one compiled template can be reused across many posts.
+    """
+    __slots__ = ('literals', 'names', 'slots')
+
+    def __init__(self, html=''):
+        self.load(split_template(html))
+
+    @classmethod
+    def from_segments(cls, segments):
+        """rebuilds a template from its segments (eg from a cached artifact)"""
+        template = cls.__new__(cls)
+        template.load(segments)
+        return template
+
+    def load(self, segments):
+        self.literals = segments[::2]
+        self.names = []
+        self.slots = []
+
+        index = {}
+        for name in segments[1::2]:
+            if name not in index:
+                index[name] = len(self.names)
+                self.names.append(name)
+            self.slots.append(index[name])
+
+    @property
+    def segments(self):
+        """the [literal, $slot$, ..., literal] form, for serializing"""
+        segments = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            segments += (self.names[slot], literal)
+        return segments
+
+    def iter_values(self, values):
+        """yields the template's chunks, filling each $slot$ from values and leaving unknown slots as they are"""
+        resolved = [ values.get(name, name) for name in self.names ]
+
+        yield self.literals[0]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            yield resolved[slot]
+            yield literal
+
+    def render_values(self, values):
+        return ''.join(self.iter_values(values))
+
+    def iter_render(self, tags):
+        """yields output chunks, filling slots from a Document's globals, then its custom tags"""
+        return self.iter_values(slot_values(tags))
+
+    def render(self, tags):
+        return ''.join(self.iter_render(tags))
+
+    def render_to(self, fileobj, tags):
+        """writes output chunk by chunk to a file-like object, never building the whole document"""
+        for chunk in self.iter_render(tags):
+            if chunk:
+                fileobj.write(chunk)
+
+
+def slot_values(tags):
+    """
+    maps $slot$ to its value: custom tags by $tag-name$, and globals,
+    which take precedence over a custom tag of the same name
+    """
+    doc = Document.coerce(tags)
+
+    values = { getvarname(k):v for k, v in doc.custom_tags.items() }
+    values.update(doc.globals)
+    return values
+
+
 def replace_variable(old, new, target, offset):
     """replace old substring with new substring in target string at offset"""
     return target[:offset] + new + target[offset + len(old):]
@@ -25,7 +114,7 @@ def collect_substring_locations(html, substring):
     locations = []
     last_found = html.find(substring)
 
-    while last_found > 0:
+    while last_found >= 0:
         locations.append(last_found)
         last_found = html.find(substring, last_found + 1)
 
@@ -34,12 +123,7 @@ def collect_substring_locations(html, substring):
 
 def compile_variables(html, variables):
     """injects $variables$ into appropriate spots in html"""
-    for varname, value in variables.items():
-        locations = collect_substring_locations(html, varname)
-        for loc in locations:
-            html = replace_variable(varname, value, html, loc)
-
-    return html
+    return CompiledTemplate(html).render_values(variables)
 
 
 def compile_globals(html, globals):
@@ -57,12 +141,14 @@ def compile_content(html, custom_tags):
 
 def compile(tags={}, html=''):
     """
-    Compiles an html string from a template html,
-    injecting global variables and content sections
-    as necessary
+    Compiles an html string from a template html (or CompiledTemplate),
+    injecting global variables and content sections as necessary
     """
-    logger.info('compile() ->\n tags: %s\nhtml: %s', repr(tags), html)
+    template = html if isinstance(html, CompiledTemplate) else CompiledTemplate(html)
+    return template.render(tags)
+
 
-    html = compile_globals(html, tags['globals'])
-    html = compile_content(html, tags['custom_tags'])
-    return html
+def compile_to(fileobj, tags={}, html=''):
+    """compile(), written chunk by chunk to a file-like object"""
+    template = html if isinstance(html, CompiledTemplate) else CompiledTemplate(html)
+    template.render_to(fileobj, tags)
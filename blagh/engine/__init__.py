@@ -0,0 +1,152 @@
+"""
+Renders posts on demand inside a long-running process.
+
+An Engine owns bounded caches of compiled templates, compiled macro
+tables and parsed imports, and Engine.render() may be called from many
+threads at once. Cached entries are only dropped when evicted or
+explicitly invalidated; nothing is re-read from disk on its own.
+"""
+
+import io
+import os
+import logging
+import threading
+import collections
+
+from blagh import lexer, parser, imports, expansion, compiler
+
+
+logger = logging.getLogger('Engine')
+
+
+DEFAULT_MAX_TEMPLATES = 64
+DEFAULT_MAX_MACRO_TABLES = 128
+DEFAULT_MAX_IMPORTS = 256
+
+
+class LRUCache(object):
+    """a thread-safe mapping that evicts its least recently used entries past max_entries"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, default)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_or_create(self, key, create):
+        """returns the entry for key, calling create() (outside the lock) to fill it if missing"""
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value)
+
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class Engine(object):
+    """
+    Compiles .blagh sources against named templates, found relative to
+    template_dir. Imports are resolved relative to base_dir unless a
+    render names its own.
+    """
+
+    def __init__(self, template_dir='.', base_dir='.',
+                 max_templates=DEFAULT_MAX_TEMPLATES,
+                 max_macro_tables=DEFAULT_MAX_MACRO_TABLES,
+                 max_imports=DEFAULT_MAX_IMPORTS):
+        self.template_dir = os.path.abspath(template_dir)
+        self.base_dir = os.path.abspath(base_dir)
+        self.templates = LRUCache(max_templates)
+        self.macro_tables = LRUCache(max_macro_tables)
+        self.resolver = imports.Resolver(LRUCache(max_imports), recheck=False)
+
+    def template_path(self, name):
+        return os.path.join(self.template_dir, name)
+
+    def add_template(self, name, html):
+        """compiles html as the template called name, replacing any cached one"""
+        template = compiler.CompiledTemplate(html)
+        self.templates.put(self.template_path(name), template)
+        return template
+
+    def template(self, name):
+        """the CompiledTemplate called name, read and compiled on first use"""
+        path = self.template_path(name)
+
+        def load():
+            logger.info('template() -> compiling %s', path)
+            with open(path) as f:
+                return compiler.CompiledTemplate(f.read())
+
+        return self.templates.get_or_create(path, load)
+
+    def macro_table(self, macros):
+        """the MacroTable for a dict of macros, shared by every post defining the same ones"""
+        return self.macro_tables.get_or_create(frozenset(macros.items()), lambda: expansion.compile_macros(macros))
+
+    def expand(self, source, base_dir=None, path=None):
+        """lexes, parses, resolves imports and expands a .blagh source into a Document"""
+        doc = parser.parse(lexer.scan_stream(io.StringIO(source)))
+        self.resolver.resolve(doc, base_dir or self.base_dir, path)
+        return expansion.expand(doc, table=self.macro_table(doc.macros))
+
+    def render(self, source, template_name, base_dir=None):
+        """compiles a .blagh source against the named template, returning the html"""
+        return self.template(template_name).render(self.expand(source, base_dir))
+
+    def render_file(self, path, template_name):
+        """render() for a .blagh file, resolving its imports relative to it"""
+        with open(path) as f:
+            source = f.read()
+
+        path = os.path.abspath(path)
+        return self.template(template_name).render(self.expand(source, os.path.dirname(path), path))
+
+    def invalidate_template(self, name):
+        """forgets the compiled template called name, so the next render re-reads it"""
+        self.templates.pop(self.template_path(name))
+
+    def invalidate_import(self, path):
+        """forgets every parsed version of the imported file at path"""
+        self.resolver.forget(os.path.abspath(path))
+
+    def clear(self):
+        """empties every cache"""
+        self.templates.clear()
+        self.macro_tables.clear()
+        self.resolver.clear()
@@ -6,38 +6,44 @@ variable expansion := $variable$ value
 """
 
 import re
+import sys
 import logging
+import functools
+import concurrent.futures
+
+from blagh import lexer, parser, imports
+from blagh.profiling import trace
+from blagh.parser import Document
+from blagh.expansion.macros import MacroTable, MacroRenderer, mark_slot
 
 
 logger = logging.getLogger('Expansion')
 
 
-def pipe(*args):
-    """
-    Returns a function that applies an initial value to a list of
-    functions, returning the accumulated value.
-    """
-    def run(sentinel=0):
-        for fn in args:
-            sentinel = fn(sentinel)
-        return sentinel
+VARIABLE = re.compile(r'(\$\w+\$)')
+WHITESPACE = re.compile(r'\s+')
 
-    return run
+# posts whose content tags total less than this are always expanded serially
+DEFAULT_PARALLEL_THRESHOLD = 256 * 1024
 
 
 def match_variable(contents):
-    return re.match('(\$\w+\$)', contents)
+    return VARIABLE.match(contents)
+
+
+# an opening <macro ...> or closing </macro> tag
+MACRO_TAG = re.compile(r'<(/?)(\w+)[^>]*>')
 
 
 def match_macro_open(contents):
     """matches for any opening <{tag_name}>"""
-    pattern = re.compile('<(\w+)[^>]*>.+', re.DOTALL)
+    pattern = re.compile(r'<(\w+)[^>]*>.+', re.DOTALL)
     return pattern.match(contents)
 
 
 def match_macro_close(name, contents):
     """matches for a specific closing </{name}>"""
-    pattern = re.compile('(.+?)<\/({name})>.?'.format(name=name), re.DOTALL)
+    pattern = re.compile(r'(.+?)</({name})>.?'.format(name=re.escape(name)), re.DOTALL)
     return pattern.match(contents)
 
 def getvarname(variable):
@@ -50,218 +56,250 @@ def replace_variable(name, data, contents, offset):
     return contents[:offset] + data + contents[offset + len(name):]
 
 
-def find_variable(ctx):
-    """wrapper for match_variable() that updates ctx object"""
-    contents = ctx['contents']
-    offset = ctx['offset']
-
-    varmatch = match_variable(contents[offset:])
-    if varmatch:
-        ctx['current_variable'] = varmatch.group(1)
-    else:
-        ctx['current_variable'] = None
-
-    return ctx
-
-
-def expand_variable(ctx):
-    """if variable found, look up its expansion content and inject into contents"""
-
-    current_variable = ctx['current_variable']
-    variables = ctx['variables']
-    contents = ctx['contents']
-    offset = ctx['offset']
-
-    if current_variable is None:
-        ctx['expanded_variable'] = None
-    else:
-        ctx['expanded_variable'] = variables[current_variable] if current_variable in variables else ''
-        ctx['contents'] = replace_variable(current_variable, ctx['expanded_variable'], contents, offset)
-
-    return ctx
-
-
-def advance_to_next_variable(ctx):
-    """adjust offset by injected data's length or by 1 if no match found"""
-    if ctx['expanded_variable'] is not None:
-        ctx['offset'] += len(ctx['expanded_variable']) + 1
-    else:
-        ctx['offset'] += 1
-
-    return ctx
-
-
 def expand_variables(variables, contents):
-    """replaces all $variables$ in contents with their corresponding data"""
-
-    memo = {
-        'offset': 0,
-        'current_variable': None,
-        'expanded_variable': None,
-        'contents': contents,
-        'variables': variables
-    }
-
-    while memo['offset'] < len(contents):
-        logger.info('expand_variables() ->\n %s', repr(( memo['offset'], memo['current_variable'] )))
-
-        memo = pipe(
-                find_variable,
-                expand_variable,
-                advance_to_next_variable
-                )(memo)
-
-    return memo['contents']
-
-
-def find_opening_macro_tag(ctx):
-    """wrapper for match_macro_open() that updates ctx object"""
-    contents = ctx['contents']
-    offset = ctx['offset']
-
-    logger.info('1. Matching opening tag of any macro at offset %d: %s', offset, contents[offset] if offset < len(contents) else '')
-
-    macromatch = match_macro_open(contents[offset:])
-    if macromatch is None:
-        ctx['current_macro'] = None
-        return ctx
-
-    macro_name = macromatch.group(1)
-    if getvarname(macro_name) in ctx['macros']:
-        logger.info('1. Matched opening tag of macro: %s', macro_name)
-        ctx['current_macro'] = macro_name
-    else:
-        ctx['current_macro'] = None
+    """
+    replaces all $variables$ in contents with their corresponding data
+    (or nothing, if undefined) in one scan, joining the output once
+    """
+    chunks = []
+    offset = 0
 
-    return ctx
+    for match in VARIABLE.finditer(contents):
+        chunks.append(contents[offset:match.start()])
+        chunks.append(variables.get(match.group(0), ''))
+        offset = match.end()
 
+    if offset == 0:
+        return contents
 
-def find_closing_macro_tag(ctx):
-    """wrapper for match_macro_close() that updates ctx object"""
+    chunks.append(contents[offset:])
+    return ''.join(chunks)
 
-    current_macro = ctx['current_macro']
-    if current_macro is None:
-        return ctx
 
-    # find the current macro's required closing tag (find the subset beyond opening tag)
-    logger.info('2. Matching closing tag of macro: %s', current_macro)
-    subset = ctx['contents'][ctx['offset'] + len('<' + current_macro + '>'):]
+def compile_macros(macros):
+    """
+    builds a MacroTable, expanding each macro's target once (after the
+    targets of the macros it uses) and splitting it at its {} slot
+    """
+    table = MacroTable(macros)
+    for name in table.order:
+        expanded = expand_macros(table, mark_slot(name, table.macros[name]))
+        table.renderers[name] = MacroRenderer(expanded)
 
-    macro_close_match = match_macro_close(current_macro, subset)
-    if not macro_close_match or macro_close_match.group(2) != current_macro:
-        logger.debug('find_closing_macro_tag() -> ERROR TRACE: \n%s', repr(ctx))
-        raise Exception('Improperly closed macro "{macro}" in subset "{subset}"'.format(macro=current_macro, subset=subset))
+    return table
 
-    logger.info('2. Matched closing tag of macro: %s', current_macro)
 
-    # update ctx with the actual content that will be injected in the expanded macro.
-    ctx['content_to_inject'] = macro_close_match.group(1)
+@functools.lru_cache(maxsize=128)
+def compile_macro_items(items):
+    """compile_macros() memoized on a frozenset of macro items, so posts sharing macros share a table"""
+    return compile_macros(dict(items))
 
-    return ctx
 
+def macro_table(macros):
+    """returns macros as a MacroTable, compiling (or reusing) one for a plain dict"""
+    if isinstance(macros, MacroTable):
+        return macros
 
-def expand_macro(ctx):
-    """looks up macro in macros table, injects desired content, then performs macro expansion"""
+    return compile_macro_items(frozenset(macros.items()))
 
-    macros = ctx['macros']
-    current_macro = ctx['current_macro']
-    content_to_inject = ctx['content_to_inject']
-    contents = ctx['contents']
-    offset = ctx['offset']
 
+def expand_macros(macros, contents):
+    """
+    replaces all <macro>data</macro> uses in contents with their
+    corresponding targets, data injected at {}.
+
+    Macro tags are tokenized in one pass into a single output list: an
+    opening tag appends its macro's prefix and a closing tag its suffix,
+    so inner macros are expanded before outer ones at any nesting depth,
+    without recursion and without rejoining any macro's data. Each
+    macro's data is stripped by trimming the text right after its opening
+    tag and right before its closing tag.
+    """
+    table = macro_table(macros)
+    if not len(table):
+        return contents
+
+    opened = []
+    output = []
+    offset = 0
+    leading = False
+
+    for match in MACRO_TAG.finditer(contents):
+        closing, name = match.group(1, 2)
+        if name not in table:
+            continue
+
+        text = contents[offset:match.start()]
+        offset = match.end()
+        if leading:
+            text = text.lstrip()
+
+        if not closing:
+            opened.append((name, match.start()))
+            output += (text, table[name].prefix)
+        elif not opened or opened[-1][0] != name:
+            raise Exception('Unexpected closing macro "{macro}" at offset {offset}'.format(macro=name, offset=match.start()))
+        else:
+            opened.pop()
+            output += (text.rstrip(), table[name].suffix)
+        leading = not closing
+
+    if opened:
+        name, start = opened[-1]
+        raise Exception('Improperly closed macro "{macro}" at offset {offset}'.format(macro=name, offset=start))
+
+    output.append(contents[offset:])
+    return ''.join(output)
+
+
+def unbalanced_macro(table, contents):
+    """(error, name, offset) for the first misplaced macro tag in contents as written, or None"""
+    opened = []
+    for match in MACRO_TAG.finditer(contents):
+        closing, name = match.group(1, 2)
+        if name not in table:
+            continue
+
+        if not closing:
+            opened.append((name, match.start()))
+        elif not opened or opened[-1][0] != name:
+            return 'Unexpected closing macro', name, match.start()
+        else:
+            opened.pop()
+
+    if opened:
+        return ('Improperly closed macro',) + opened[-1]
+
+    return None
+
+
+def describe_error(doc, table, tag_name, tag_contents, error):
+    """
+    error, prefixed with where it happened. Macro errors are found again
+    in the raw tag contents, so their line and col point into the source
+    rather than into the whitespace-collapsed text expand_macros() saw
+    """
+    where = parser.describe_location(doc, tag_name)
+    found = unbalanced_macro(table, tag_contents)
+    if found is None:
+        return '{error} ({where})'.format(error=error, where=where)
+
+    kind, name, offset = found
+    location = doc.locations.get(tag_name)
+    if location is None:
+        position = 'offset {offset}'.format(offset=offset)
+    else:
+        position = 'line {0}, col {1}'.format(*lexer.advance_position(location[0], location[1], tag_contents, 0, offset))
 
-    if current_macro is None:
-        ctx['macro_expansion'] = None
-        return ctx
+    return '{kind} "{macro}" at {position} ({where})'.format(kind=kind, macro=name, position=position, where=where)
 
-    logger.info('3. Expanding macro %s with content "%s"', current_macro, content_to_inject)
 
-    # call expand_macros() in case this injected data can itself be expanded
-    # example: "<foo> this </foo>" where foo is a macro
-    fully_expanded_content_to_inject = expand_macros(macros, content_to_inject.lstrip().rstrip())
+def expand_contents(variables, macros, contents):
+    """collapses whitespace, then injects variables then macros into contents"""
+    contents = WHITESPACE.sub(' ', contents)
+    contents = expand_variables(variables, contents)
+    contents = expand_macros(macro_table(macros), contents)
+    return contents
 
-    # macro_expansion looks like "<div> {} <div>", which means
-    # we can directly use Python string interpolation
 
-    key = getvarname(current_macro)
-    target = macros[key] if key in macros else ''
+def inject_data_into_content(ctx, contents):
+    """injects variables then macros into contents"""
+    return expand_contents(ctx['variables'], ctx['macros'], contents)
 
-    # call expand_macros() in case the TARGET data is not fully expanded.
-    # example: the key "$convo$" might point to a value "<foo>{}</foo>" where foo is another macro to be expanded
-    fully_expanded_target = expand_macros(macros, target.lstrip().rstrip())
 
-    ctx['macro_expansion'] = fully_expanded_target.format(fully_expanded_content_to_inject)
-    content_to_replace = '<' + current_macro + '>' + content_to_inject + '</' + current_macro + '>'
 
-    # now that we've built up the fully expanded macro, time to replace the old content
+def expand_tag(doc, table, tag_name, tag_contents):
+    """expand_contents() wrapper that reports which tag failed, and where"""
+    trace(logger, 'expand_tag() -> %s (%d chars)', tag_name, len(tag_contents))
+    try:
+        return expand_contents(doc.variables, table, tag_contents)
+    except Exception as e:
+        raise Exception(describe_error(doc, table, tag_name, tag_contents, e)) from e
 
-    ctx['contents'] = replace_variable(content_to_replace, ctx['macro_expansion'], contents, offset)
 
-    logger.info('3. Expanded macro %s: "%s"', current_macro, fully_expanded_content_to_inject)
+def gil_enabled():
+    """False only on a free-threaded build running without the GIL"""
+    return getattr(sys, '_is_gil_enabled', lambda: True)()
 
-    return ctx
 
+def parallel_executor(workers):
+    """a process pool, or a thread pool when threads can run Python in parallel"""
+    if gil_enabled():
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
 
-def advance_to_next_macro(ctx):
-    """advances offset so we can continue expanding macros we encounter"""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
 
-    logger.info('4. Advancing to next macro')
 
-    if ctx['macro_expansion'] is None:
-        ctx['offset'] += 1
-    else:
-        new_offset = len(ctx['macro_expansion'])
-        ctx['offset'] += new_offset
+def expand_tags_in_parallel(doc, workers):
+    """expands every custom tag across a pool, returning results in tag order"""
+    names = list(doc.custom_tags)
+    table = macro_table(doc.macros)
 
-    # reset some context variables
-    ctx['current_macro'] = ctx['content_to_inject'] = ctx['macro_expansion'] = None
+    with parallel_executor(workers) as executor:
+        futures = [ executor.submit(expand_contents, doc.variables, doc.macros, doc.custom_tags[name]) for name in names ]
 
-    return ctx
+        expanded = []
+        for name, future in zip(names, futures):
+            try:
+                expanded.append(future.result())
+            except Exception as e:
+                raise Exception(describe_error(doc, table, name, doc.custom_tags[name], e)) from e
 
+    return zip(names, expanded)
 
 
-def expand_macros(macros, contents):
-    """replaces all $macros$ in contents with their corresponding {} data"""
+def expand(ctx={}, workers=None, threshold=DEFAULT_PARALLEL_THRESHOLD, table=None):
+    """
+    Handles variable and macro expansion into content tags.
+    Input must be a Document (or a dict) of parsed macros, variables,
+    globals, and custom content tags.
 
-    memo = {
-        'offset': 0,
-        'current_macro': None,
-        'content_to_inject': None,
-        'macro_expansion': None,
-        'contents': contents,
-        'macros': macros
-    }
+    With workers > 1, posts whose content tags total at least threshold
+    characters are expanded across a pool of that many workers. Each tag
+    is expanded independently, so the result is identical to the serial
+    path. table is the doc's compiled MacroTable, if the caller has one.
+    """
+    doc = Document.coerce(ctx)
+    table = macro_table(doc.macros) if table is None else table
+    custom_tags = doc.custom_tags
 
-    while memo['offset'] < len(contents):
-        memo = pipe(
-                find_opening_macro_tag,
-                find_closing_macro_tag,
-                expand_macro,
-                advance_to_next_macro
-                )(memo)
+    if workers and workers > 1 and len(custom_tags) > 1 and sum(map(len, custom_tags.values())) >= threshold:
+        custom_tags.update(expand_tags_in_parallel(doc, workers))
+        return doc
 
-    return memo['contents']
+    # inject macros and variables into custom content tags
+    for tag_name,tag_contents in custom_tags.items():
+        custom_tags[tag_name] = expand_tag(doc, table, tag_name, tag_contents)
 
+    return doc
 
-def inject_data_into_content(ctx, contents):
-    """injects variables then macros into contents"""
-    contents = re.sub('\s+', ' ', contents)
-    contents = expand_variables(ctx['variables'], contents)
-    contents = expand_macros(ctx['macros'], contents)
-    return contents
 
+DEFINITION_TAGS = ('imports', 'globals', 'variables', 'macros')
 
 
-def expand(ctx={}):
+def expand_stream(tags, ctx=None, base_dir=None):
     """
-    Handles variable and macro expansion into content tags.
-    Input must be a dict of parsed macros, variables, globals,
-    and custom content tags.
+    Lazily parses and expands (tag_name, tag_contents) pairs, yielding
+    (tag_name, expanded_contents) for each custom content tag as soon as
+    it arrives. Definition tags fill in the Document passed as ctx and
+    must precede content tags; imports are resolved relative to base_dir
+    once the first content tag arrives.
     """
-
-    # inject macros and variables into custom content tags
-    custom_tags = ctx['custom_tags']
-    for tag_name,tag_contents in ctx['custom_tags'].items():
-        custom_tags[tag_name] = inject_data_into_content(ctx, tag_contents)
-
-    return ctx
+    ctx = Document() if ctx is None else Document.coerce(ctx)
+
+    seen_content = False
+    table = None
+    for tag_name,tag_contents in parser.iter_tags(tags):
+        if tag_name in DEFINITION_TAGS:
+            if seen_content:
+                raise Exception('Tag "{tag}" must precede content tags when streaming'.format(tag=tag_name))
+            parser.parse_tag(ctx, tag_name, tag_contents)
+        else:
+            if not seen_content:
+                if base_dir is not None:
+                    imports.resolve(ctx, base_dir)
+                table = macro_table(ctx.macros)
+            seen_content = True
+            parser.parse_tag(ctx, tag_name, tag_contents)
+            ctx.custom_tags[tag_name] = expand_tag(ctx, table, tag_name, ctx.custom_tags[tag_name])
+            yield tag_name, ctx.custom_tags[tag_name]
@@ -0,0 +1,108 @@
+"""
+Macro tables: a document's macros, ordered so every macro comes after
+the macros its own target uses.
+
+macro := $name$ -> target
+target := html with <other-macro>...</other-macro> uses and one {}
+"""
+
+import re
+
+
+MACRO_USE = re.compile(r'<(\w+)[^>]*>')
+
+# stands in for a target's own {} while the macros it uses are expanded
+SLOT_MARK = '\x00'
+
+
+def barename(variable):
+    """get name from $name$"""
+    return variable[1:-1]
+
+
+def mark_slot(name, target):
+    """replaces a target's first {} with SLOT_MARK"""
+    slot = target.find('{}')
+    if slot < 0:
+        raise Exception('Macro "{macro}" needs a data placement point represented by braces'.format(macro='$' + name + '$'))
+
+    return target[:slot] + SLOT_MARK + target[slot + 2:]
+
+
+class MacroRenderer(object):
+    """
+    A compiled macro: the literal html before and after its data slot.
+    Any other braces in the target are plain text.
+    """
+    __slots__ = ('prefix', 'suffix')
+
+    def __init__(self, expanded):
+        self.prefix, _, self.suffix = expanded.partition(SLOT_MARK)
+
+    def __call__(self, data):
+        return self.prefix + data + self.suffix
+
+    def __str__(self):
+        return self.prefix + '{}' + self.suffix
+
+
+class MacroTable(object):
+    """
+    Maps each macro name (without dollar signs) to its compiled
+    MacroRenderer. Renderers are filled in by expansion.compile_macros()
+    in dependency order, so each use of a macro is a lookup plus an
+    injection rather than a re-expansion.
+    """
+    __slots__ = ('macros', 'dependencies', 'order', 'renderers')
+
+    def __init__(self, macros):
+        self.macros = { barename(k): v.strip() for k, v in macros.items() }
+        self.dependencies = { name: self.find_dependencies(target) for name, target in self.macros.items() }
+        self.order = self.sort()
+        self.renderers = {}
+
+    def find_dependencies(self, target):
+        """the macros used by a target, in order of first use"""
+        used = []
+        for match in MACRO_USE.finditer(target):
+            name = match.group(1)
+            if name in self.macros and name not in used:
+                used.append(name)
+
+        return used
+
+    def sort(self):
+        """topologically orders macros (dependencies first), failing on cycles"""
+        order = []
+        done = set()
+
+        for root in self.macros:
+            if root in done:
+                continue
+
+            # iterative depth-first search; path holds the macros being visited
+            path = [root]
+            pending = [iter(self.dependencies[root])]
+            while pending:
+                name = next(pending[-1], None)
+                if name is None:
+                    done.add(path[-1])
+                    order.append(path.pop())
+                    pending.pop()
+                elif name in path:
+                    cycle = path[path.index(name):] + [name]
+                    raise Exception('Macro cycle: {cycle}'.format(cycle=' -> '.join('$' + n + '$' for n in cycle)))
+                elif name not in done:
+                    path.append(name)
+                    pending.append(iter(self.dependencies[name]))
+
+        return order
+
+    def __contains__(self, name):
+        return name in self.renderers
+
+    def __getitem__(self, name):
+        return self.renderers[name]
+
+    def __len__(self):
+        return len(self.renderers)
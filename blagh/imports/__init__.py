@@ -0,0 +1,139 @@
+"""
+Resolves <imports> blocks.
+
+import := $name$ -> name.blagh, relative to the importing file
+
+Only globals, variables and macros are imported. Imports are merged in
+the order they are listed (an import's own imports come first), each
+file at most once. Redefining a name within a block type is an error.
+"""
+
+import io
+import os
+import hashlib
+import logging
+
+from blagh import lexer, parser
+
+
+logger = logging.getLogger('Imports')
+
+
+IMPORTED_BLOCKS = (('globals', 'Global'), ('variables', 'Variable'), ('macros', 'Macro'))
+
+
+def import_path(name, base_dir):
+    """$name$ -> base_dir/name.blagh"""
+    return os.path.abspath(os.path.join(base_dir, name + '.blagh'))
+
+
+def digest(source):
+    """content hash of a .blagh source"""
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def merge(doc, imported, path):
+    """merges an imported document's definitions into doc, failing on name conflicts"""
+    for block, kind in IMPORTED_BLOCKS:
+        definitions = doc[block]
+        for name, value in imported[block].items():
+            if name in definitions:
+                raise Exception('{kind} "{name}" imported from {path} is already defined'.format(kind=kind, name=name, path=path))
+            definitions[name] = value
+
+    return doc
+
+
+class Resolver(object):
+    """
+    Parses each imported file once per process, keyed by its path and
+    content hash, so a file shared by many posts is only parsed once.
+    documents may be any mapping with get() and item assignment (eg a
+    bounded LRU); by default it grows without limit.
+
+    With recheck (the default), every load re-reads and re-hashes the
+    file, so edits are picked up; without it, a parsed file is reused
+    without touching the disk until it is forgotten.
+    """
+
+    def __init__(self, documents=None, recheck=True):
+        self.documents = {} if documents is None else documents
+        self.digests = {}
+        self.recheck = recheck
+
+    def load(self, path):
+        """returns the parsed (but unresolved) document at path"""
+        if not self.recheck:
+            doc = self.documents.get((path, None))
+            if doc is not None:
+                return doc
+
+        with open(path) as f:
+            source = f.read()
+
+        self.digests[path] = digest(source)
+        key = (path, self.digests[path] if self.recheck else None)
+        doc = self.documents.get(key)
+        if doc is None:
+            logger.info('load() -> parsing %s', path)
+            doc = parser.parse(lexer.scan_stream(io.StringIO(source)))
+            self.documents[key] = doc
+
+        return doc
+
+    def collect(self, names, base_dir, order, seen, stack):
+        """appends (path, document) for names and their own imports to order, depth first"""
+        for name in names:
+            path = import_path(name, base_dir)
+            if path in stack:
+                cycle = ' -> '.join(stack[stack.index(path):] + [path])
+                raise Exception('Import cycle: {cycle}'.format(cycle=cycle))
+            if path in seen:
+                continue
+
+            doc = self.load(path)
+            self.collect(doc.imports, os.path.dirname(path), order, seen, stack + [path])
+            seen.add(path)
+            order.append((path, doc))
+
+        return order
+
+    def resolve(self, doc, base_dir, path=None):
+        """
+        merges every import of doc (found relative to base_dir) into doc.
+        path is doc's own file, if it has one, so importing it is a cycle.
+        """
+        stack = [os.path.abspath(path)] if path else []
+        for imported_path, imported in self.collect(doc['imports'], base_dir, [], set(), stack):
+            merge(doc, imported, imported_path)
+
+        return doc
+
+    def dependencies(self, doc, base_dir, path=None):
+        """returns [(path, content hash)] for every file doc imports, directly or not"""
+        stack = [os.path.abspath(path)] if path else []
+        return [ (p, self.digests[p]) for p, _ in self.collect(doc['imports'], base_dir, [], set(), stack) ]
+
+    def forget(self, path):
+        """drops every parsed version of the file at path"""
+        for key in list(self.documents.keys()):
+            if key[0] == path:
+                self.documents.pop(key, None)
+        self.digests.pop(path, None)
+
+    def clear(self):
+        self.documents.clear()
+        self.digests.clear()
+
+
+RESOLVER = Resolver()
+
+
+def resolve(doc, base_dir, path=None):
+    """resolves doc's imports with the process-wide resolver"""
+    return RESOLVER.resolve(doc, base_dir, path)
+
+
+def dependencies(doc, base_dir, path=None):
+    """lists doc's imported files and their hashes with the process-wide resolver"""
+    return RESOLVER.dependencies(doc, base_dir, path)
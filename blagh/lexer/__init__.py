@@ -4,22 +4,59 @@ Scans a blagh file into its content tags.
 
 import re
 import logging
+import functools
+
+from blagh.profiling import trace
 
 
 logger = logging.getLogger('Lexer')
 
 
-def pipe(*args):
+OPEN_TAG = re.compile(r'<(\w+)[^<>]*>')
+CLOSE_TAG = re.compile(r'</(\w+)>')
+
+
+class Token(object):
     """
-    Returns a function that applies an initial value to a list of
-    functions, returning the accumulated value.
+    A top-level tag's span in its source. The contents run from start to
+    end, beginning at line/col, and are only sliced out when text is read.
+    Unpacks like a (tag_name, tag_contents) pair.
     """
-    def run(sentinel=0):
-        for fn in args:
-            sentinel = fn(sentinel)
-        return sentinel
+    __slots__ = ('tag', 'start', 'end', 'line', 'col', 'source')
+
+    def __init__(self, tag, start, end, line, col, source):
+        self.tag = tag
+        self.start = start
+        self.end = end
+        self.line = line
+        self.col = col
+        self.source = source
+
+    @property
+    def text(self):
+        return self.source[self.start:self.end]
+
+    def __iter__(self):
+        return iter((self.tag, self.text))
+
+    def __len__(self):
+        return self.end - self.start
 
-    return run
+    def __repr__(self):
+        return 'Token({tag!r}, line={line}, col={col}, length={length})'.format(tag=self.tag, line=self.line, col=self.col, length=len(self))
+
+    def locate(self, offset=0):
+        """returns the (line, col) of an offset into this token's contents"""
+        return advance_position(self.line, self.col, self.source, self.start, self.start + offset)
+
+
+def advance_position(line, col, src, start, end):
+    """returns the (line, col) reached after moving from start to end in src"""
+    newlines = src.count('\n', start, end)
+    if newlines == 0:
+        return line, col + end - start
+
+    return line + newlines, end - src.rfind('\n', start, end)
 
 
 def advance(src, n):
@@ -27,92 +64,159 @@ def advance(src, n):
     return src[n:]
 
 
+@functools.lru_cache(maxsize=None)
+def close_tag_pattern(tag):
+    """compiles (once per tag name) the greedy pattern used by match_close_tag()"""
+    return re.compile(r'(.+)</({tag})>.?'.format(tag=re.escape(tag)), re.DOTALL)
+
+
 def match_open_tag(src):
     """matches for any opening <{tag_name}>"""
-    pattern = re.compile('<(\w+)[^>]*>.+', re.DOTALL)
-    return pattern.match(src)
+    match = OPEN_TAG.match(src)
+    if match and match.end() < len(src):
+        return match
+    return None
 
 
 def match_close_tag(tag, src):
     """matches for a specific closing </{tag_name}>"""
-    pattern = re.compile('(.+)<\/({tag})>.?'.format(tag=tag), re.DOTALL)
-    return pattern.match(src)
+    return close_tag_pattern(tag).match(src)
 
 
-def find_opening_tag(ctx):
-    """wrapper for match_open_tag() that updates input ctx object"""
+def index_closing_tags(program):
+    """maps each tag name to the offset of its last closing </{tag_name}>"""
+    closings = {}
+    for match in CLOSE_TAG.finditer(program):
+        closings[match.group(1)] = match.start()
 
-    # only advance 1 token if no opening tag found
-    opening_tag_match = match_open_tag(ctx['source'])
-    if opening_tag_match:
-        ctx['current_tag'] = opening_tag_match.group(1)
-        ctx['cursor_advance'] = len('<' + ctx['current_tag'] + '>')
-    else:
-        ctx['current_tag'] = None
-        ctx['cursor_advance'] = 1
+    return closings
 
-    return ctx
 
+def tokenize(program):
+    """
+    Yields a Token for each top-level tag in a program
 
-def find_closing_tag(ctx):
-    """wrapper for match_close_tag() that updates input ctx object"""
-    current_tag = ctx['current_tag']
-    if current_tag is None:
-        return ctx
+    A tag's contents run up to the *last* matching closing tag in the
+    program. Closing tags are indexed in a single pass up front, so the
+    scan never re-slices or backtracks over the remaining source.
+    """
+    closings = index_closing_tags(program)
+    seen = set()
+    cursor = 0
+    line, col = 1, 1
 
-    # match against substring that does not include the opening tag
-    subset = ctx['source'][ctx['cursor_advance']:]
-    closing_tag_match = match_close_tag(current_tag, subset)
-    if not closing_tag_match or closing_tag_match.group(2) != current_tag:
-        raise Exception('Improperly closed tag "{tag}" at location {loc} ("{str}")'.format(tag=current_tag, loc=ctx['cursor_advance'], str=ctx['contents'][ctx['cursor_advance':]]))
+    while True:
+        opening_tag_match = OPEN_TAG.search(program, cursor)
+        if opening_tag_match is None:
+            break
 
-    # advance cursor by length of tag contents and closing tag
-    ctx['tag_contents'] = closing_tag_match.group(1)
-    ctx['cursor_advance'] += len(ctx['tag_contents']) + len('</' + current_tag + '>')
+        current_tag = opening_tag_match.group(1)
+        start = opening_tag_match.end()
+        end = closings.get(current_tag, -1)
 
-    return ctx
+        line, col = advance_position(line, col, program, cursor, opening_tag_match.start())
+        if end < start:
+            raise Exception('Improperly closed tag "{tag}" at line {line}, col {col}'.format(tag=current_tag, line=line, col=col))
 
+        if current_tag in seen:
+            raise Exception('Tag "{tag}" already exists at line {line}, col {col}'.format(tag=current_tag, line=line, col=col))
 
-def add_tag_to_dict(ctx):
-    """adds a tag and its content to the dict of tags in the input ctx object"""
-    current_tag = ctx['current_tag']
-    if current_tag is None:
-        return ctx
+        line, col = advance_position(line, col, program, opening_tag_match.start(), start)
+        seen.add(current_tag)
+        token = Token(current_tag, start, end, line, col, program)
+        trace(logger, 'tokenize() -> %r', token)
+        yield token
 
-    if current_tag in ctx['tags']:
-        raise Exception('Tag "{tag}" already exists'.format(tag=current_tag))
+        cursor = end + len('</' + current_tag + '>')
+        line, col = advance_position(line, col, program, start, cursor)
 
-    ctx['tags'][current_tag] = ctx['tag_contents']
-    return ctx
 
+def scan(program):
+    """
+    Scans a program and returns a dict of tag_name:tag_contents pairs
+    """
+    return { token.tag: token.text for token in tokenize(program) }
 
-def advance_to_next_tag(ctx):
-    """wrapper for advance() that advances cursor based on input ctx object"""
-    ctx['source'] = advance(ctx['source'], ctx['cursor_advance'])
-    return ctx
 
+DEFAULT_CHUNK_SIZE = 64 * 1024
 
-def scan(program):
+
+@functools.lru_cache(maxsize=None)
+def nested_tag_pattern(tag):
+    """compiles (once per tag name) a pattern for <{tag}...> and </{tag}>"""
+    return re.compile(r'</{tag}>|<{tag}(?!\w)[^<>]*>'.format(tag=re.escape(tag)))
+
+
+def resume_offset(buffer, offset):
+    """where to resume searching once more input arrives (a tag may be cut off at the last '<')"""
+    last_open = buffer.rfind('<', offset)
+    return last_open if last_open >= 0 else len(buffer)
+
+
+def scan_stream(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
     """
-    Scans a program and returns a dict of tag_name:tag_contents pairs
+    Scans a file object chunk by chunk, yielding a Token (which unpacks as
+    a (tag_name, tag_contents) pair) as soon as each tag is closed.
+
+    Tags are closed by their balanced </{tag_name}>, which agrees with
+    scan() on every post whose top-level tag names appear once. Only the
+    section being scanned is buffered, never the whole file.
     """
-    ctx = {
-        'tags': {},
-        'source': program[:],
-        'current_tag': None,
-        'tag_contents': None,
-        'cursor_advance': 1
-    }
-
-    while len(ctx['source']) > 0:
-        logger.info('scan() ->\n parsing ctx: %s', repr(( ctx['cursor_advance'], ctx['source'], ctx['current_tag'] )))
-
-        # runs pipeline of functions in order, transforming ctx in the process
-        ctx = pipe(
-                find_opening_tag,
-                find_closing_tag,
-                add_tag_to_dict,
-                advance_to_next_tag
-                )(ctx)
-
-    return ctx['tags']
+    buffer = ''
+    offset = 0
+    current_tag = None
+    start = depth = 0
+    seen = set()
+    exhausted = False
+    line, col = 1, 1
+
+    while True:
+        if current_tag is None:
+            match = OPEN_TAG.search(buffer, offset)
+            if match is not None:
+                current_tag = match.group(1)
+                line, col = advance_position(line, col, buffer, 0, match.start())
+                if current_tag in seen:
+                    raise Exception('Tag "{tag}" already exists at line {line}, col {col}'.format(tag=current_tag, line=line, col=col))
+
+                # drop everything before the section we are about to scan
+                tag_line, tag_col = line, col
+                line, col = advance_position(line, col, buffer, match.start(), match.end())
+                buffer = buffer[match.end():]
+                offset = start = 0
+                depth = 1
+                continue
+        else:
+            match = nested_tag_pattern(current_tag).search(buffer, offset)
+            if match is not None:
+                offset = match.end()
+                depth += -1 if match.group(0).startswith('</') else 1
+                if depth == 0:
+                    seen.add(current_tag)
+                    token = Token(current_tag, start, match.start(), line, col, buffer)
+                    trace(logger, 'scan_stream() -> %r', token)
+                    yield token
+
+                    line, col = advance_position(line, col, buffer, start, offset)
+                    buffer = buffer[offset:]
+                    offset = 0
+                    current_tag = None
+                continue
+
+        if exhausted:
+            break
+
+        offset = resume_offset(buffer, offset)
+        if current_tag is None:
+            line, col = advance_position(line, col, buffer, 0, offset)
+            buffer = buffer[offset:]
+            offset = 0
+
+        chunk = fileobj.read(chunk_size)
+        if chunk:
+            buffer += chunk
+        else:
+            exhausted = True
+
+    if current_tag is not None:
+        raise Exception('Improperly closed tag "{tag}" at line {line}, col {col}'.format(tag=current_tag, line=tag_line, col=tag_col))
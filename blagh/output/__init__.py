@@ -0,0 +1,145 @@
+"""
+Writes output files atomically, and only when their contents change.
+
+Each file is streamed into a temporary file beside it while being
+hashed. If the file already on disk has the same size and hash, the
+temporary file is discarded and the original (and its mtime) is left
+alone; otherwise the temporary file is renamed over it, so readers
+never see a half-written page.
+
+A Writer made with compress=True also keeps a gzipped copy beside each
+file (index.html.gz), compressed while the file is streamed out, so a
+static server can send it as is.
+"""
+
+import os
+import zlib
+import hashlib
+import logging
+import tempfile
+
+from blagh import cache
+from blagh.output.minify import minify
+
+
+logger = logging.getLogger('Output')
+
+
+WRITE_BUFFER_SIZE = 256 * 1024
+
+GZIP_SUFFIX = '.gz'
+GZIP_LEVEL = 9
+# zlib's wbits for a gzip container (with a zero mtime, so output is reproducible)
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def create_temporary(dirname, name):
+    """
+    creates a uniquely named .tmp file beside dirname/name, returning
+    (fd, path). Unlike mkstemp() (always 0600), it is created 0666 less
+    the umask, exactly as a plain open() would create the final file.
+    """
+    for _ in range(tempfile.TMP_MAX):
+        path = os.path.join(dirname or '.', '.{name}.{token}.tmp'.format(name=name, token=os.urandom(6).hex()))
+        try:
+            return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), 0o666), path
+        except FileExistsError:
+            continue
+
+    raise FileExistsError('No usable temporary file name beside {path}'.format(path=os.path.join(dirname, name)))
+
+
+class Writer(object):
+    """
+    Writes a batch of files, remembering the directories it has created
+    and counting the files it wrote versus skipped as unchanged. With
+    compress, every file gets a .gz variant too.
+    """
+
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.directories = set()
+        self.written = 0
+        self.skipped = 0
+
+    def ensure_directory(self, dirname):
+        """creates dirname (and its parents) unless it already exists"""
+        if dirname and dirname not in self.directories:
+            os.makedirs(dirname, exist_ok=True)
+            self.directories.add(dirname)
+
+    def write(self, path, chunks):
+        """
+        writes an iterable of str chunks to path, returning True if the
+        file was written or False if it already held exactly this content
+        """
+        data = ( chunk.encode('utf-8') for chunk in chunks if chunk )
+        if not self.compress:
+            written = self.write_bytes(path, data)
+            if written and os.path.exists(path + GZIP_SUFFIX):
+                # a variant left by an earlier compressed build is now stale
+                os.remove(path + GZIP_SUFFIX)
+            return written
+
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+        compressed = []
+
+        def tee():
+            for block in data:
+                compressed.append(compressor.compress(block))
+                yield block
+
+        written = self.write_bytes(path, tee())
+        compressed.append(compressor.flush())
+        self.write_bytes(path + GZIP_SUFFIX, compressed)
+        return written
+
+    def write_bytes(self, path, blocks):
+        """write() for an iterable of bytes"""
+        dirname = os.path.dirname(path)
+        self.ensure_directory(dirname)
+
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, tmp = create_temporary(dirname, os.path.basename(path))
+        try:
+            with os.fdopen(fd, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                for block in blocks:
+                    digest.update(block)
+                    size += len(block)
+                    f.write(block)
+
+            if self.is_unchanged(path, size, digest.hexdigest()):
+                os.remove(tmp)
+                self.skipped += 1
+                logger.info('write() -> %s unchanged', path)
+                return False
+
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self.written += 1
+        logger.info('write() -> wrote %s', path)
+        return True
+
+    def write_text(self, path, text):
+        return self.write(path, (text,))
+
+    def write_many(self, files):
+        """writes (path, chunks) pairs, returning how many were written"""
+        return sum(1 for path, chunks in files if self.write(path, chunks))
+
+    def is_unchanged(self, path, size, digest):
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            return cache.hash_file(path) == digest
+        except OSError:
+            return False
+
+    def summary(self):
+        return 'wrote {written}, unchanged {skipped}'.format(written=self.written, skipped=self.skipped)
@@ -0,0 +1,28 @@
+"""
+Minifies html by collapsing whitespace.
+
+Every run of whitespace becomes a single space, and leading and trailing
+whitespace is dropped, which renders the same everywhere except inside
+<pre>, <textarea> and <script> elements; those are left untouched.
+"""
+
+import re
+
+
+# an element whose whitespace is significant, captured whole
+PRESERVED = re.compile(r'(<(pre|textarea|script)\b[^>]*>.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+WHITESPACE = re.compile(r'\s+')
+
+
+def minify(html):
+    """collapses whitespace outside <pre>, <textarea> and <script>"""
+    parts = PRESERVED.split(html)
+
+    # split() yields [text, element, tag name, text, element, tag name, ..., text]
+    chunks = []
+    for i in range(0, len(parts), 3):
+        chunks.append(WHITESPACE.sub(' ', parts[i]))
+        if i + 1 < len(parts):
+            chunks.append(parts[i + 1])
+
+    return ''.join(chunks).strip()
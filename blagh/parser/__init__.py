@@ -27,87 +27,154 @@ var := "$" + STRING + "$"
 import re
 import logging
 
+from blagh.parser.document import Assignment, Document
+
 
 logger = logging.getLogger('Parser')
 
 
+# one `name := value` line; surrounding spaces and tabs are not captured
+ASSIGNMENT = re.compile(r'^[^\S\n]*([^\n]*?)[^\S\n]*:=[^\S\n]*([^\n]*?)[^\S\n]*$', re.MULTILINE)
+
+
+def iter_assignments(contents, line=1):
+    """
+    yields an Assignment for each `name := value` line in one pass over
+    contents. line is the line number contents starts at.
+    """
+    offset = 0
+    for match in ASSIGNMENT.finditer(contents):
+        name, value = match.group(1, 2)
+
+        # a line with more than one := is not an assignment
+        if ':=' in value:
+            continue
+
+        line += contents.count('\n', offset, match.start())
+        offset = match.start()
+        if '\t' in name or '\t' in value:
+            name, value = name.replace('\t', ''), value.replace('\t', '')
+
+        yield Assignment(name, value, line)
+
+
+IMPORT = re.compile(r'\$([^$\s]+)\$')
+
+
+def parse_imports(contents):
+    """parses an <imports> block: one $name$ per line, in order"""
+    return IMPORT.findall(contents)
+
+
 def parse_assignments(contents):
     """parses variable assignment: name := value \n"""
-    # split on \n and := to parse assignments
-    lines = contents.split('\n')
-    assignments = [ re.sub(r'[\n\t]', '', x).split(':=') for x in lines ]
-
-    # strip trailing whitespace. only keep pairs
-    return [ [ pair[0].lstrip().rstrip(), pair[1].lstrip().rstrip() ] for pair in assignments if len(pair) == 2 ]
+    return [ [ a.name, a.value ] for a in iter_assignments(contents) ]
 
 
-def validate_one_macro(name, value, macros):
+def validate_one_macro(name, value, macros, line=None):
+    where = '' if line is None else ' at line {line}'.format(line=line)
     if value.find('{}') < 0:
-        raise Exception('Macro "{macro}" needs a data placement point represented by braces'.format(macro=name))
+        raise Exception('Macro "{macro}" needs a data placement point represented by braces{where}'.format(macro=name, where=where))
     elif name in macros:
-        raise Exception('Macro "{macro}" already in dict'.format(macro=name))
+        raise Exception('Macro "{macro}" already in dict{where}'.format(macro=name, where=where))
 
     return value
 
 
-def validate_one_variable(name, value, variables):
+def validate_one_variable(name, value, variables, line=None):
     if name in variables:
-        raise Exception('Variable "{v}" already in dict'.format(v=name))
+        where = '' if line is None else ' at line {line}'.format(line=line)
+        raise Exception('Variable "{v}" already in dict{where}'.format(v=name, where=where))
 
     return value
 
 
-def validate_macros(contents):
+def validate_macros(contents, line=1):
     """
     ensure macros have form [ name := <div> some macro {} </div> ],
     where the braces indicate placement of enclosing data
     """
     macros = {}
-    assignments = parse_assignments(contents)
 
-    for name,value in assignments:
-        macros[name] = validate_one_macro(name, value, macros)
+    for a in iter_assignments(contents, line):
+        macros[a.name] = validate_one_macro(a.name, a.value, macros, a.line)
 
     return macros
 
 
-def validate_variables(contents):
+def validate_variables(contents, line=1):
     variables = {}
-    assignments = parse_assignments(contents)
 
-    for name,value in assignments:
-        variables[name] = validate_one_variable(name, value, variables)
+    for a in iter_assignments(contents, line):
+        variables[a.name] = validate_one_variable(a.name, a.value, variables, a.line)
 
     return variables
 
 
-def validate_and_parse_tag(ctx, name, contents):
+def validate_and_parse_tag(ctx, name, contents, line=1):
     """ensure tag is valid, then parse its contents"""
     if name == 'macros':
-        ctx['macros'] = validate_macros(contents)
+        ctx['macros'] = validate_macros(contents, line)
     elif name in ['globals', 'variables']:
-        ctx[name] = validate_variables(contents)
+        ctx[name] = validate_variables(contents, line)
+    elif name == 'imports':
+        ctx['imports'] = parse_imports(contents)
     else:
         ctx['custom_tags'][name] = contents
 
     return ctx
 
 
+def iter_tags(tags):
+    """
+    yields (tag_name, tag_contents) from a dict or a lazy iterable of pairs.
+    lexer tokens are passed through as the contents so their spans survive.
+    """
+    if hasattr(tags, 'items'):
+        yield from tags.items()
+        return
+
+    for tag in tags:
+        if hasattr(tag, 'locate'):
+            yield tag.tag, tag
+        else:
+            yield tag
+
+
+def describe_location(ctx, tag_name):
+    """describes where a tag starts, if its lexer token was seen"""
+    location = ctx.get('locations', {}).get(tag_name)
+    if location is None:
+        return 'in tag "{tag}"'.format(tag=tag_name)
+
+    return 'in tag "{tag}" at line {line}, col {col}'.format(tag=tag_name, line=location[0], col=location[1])
+
+
+def parse_tag(ctx, tag_name, tag_contents):
+    """records a lexer token's location, then validates and parses its contents"""
+    line = 1
+    if hasattr(tag_contents, 'locate'):
+        ctx['locations'][tag_name] = tag_contents.locate()
+        line = tag_contents.line
+        tag_contents = tag_contents.text
+
+    try:
+        return validate_and_parse_tag(ctx, tag_name, tag_contents, line)
+    except Exception as e:
+        raise Exception('{error} ({where})'.format(error=e, where=describe_location(ctx, tag_name))) from e
+
+
 def parse(tags={}):
     """
-    Parses custom content tags into a dict
+    Parses tags into a Document. Tags may be a dict from lexer.scan()
+    or a lazy iterable of pairs or tokens from lexer.tokenize() and
+    lexer.scan_stream().
     """
-    logger.info('parse() ->\n %s', repr(tags))
 
-    ctx = {
-        'macros': {},
-        'globals': {},
-        'variables': {},
-        'custom_tags': {}
-    }
+    ctx = Document()
 
     # parse tag contents
-    for tag_name,tag_contents in tags.items():
-        ctx = validate_and_parse_tag(ctx, tag_name, tag_contents)
+    for tag_name,tag_contents in iter_tags(tags):
+        ctx = parse_tag(ctx, tag_name, tag_contents)
 
     return ctx
@@ -0,0 +1,68 @@
+"""
+Typed nodes built by parser.parse() and consumed by the later stages.
+"""
+
+
+class Assignment(object):
+    """one `name := value` line of a <globals>, <variables> or <macros> block"""
+    __slots__ = ('name', 'value', 'line')
+
+    def __init__(self, name, value, line):
+        self.name = name
+        self.value = value
+        self.line = line
+
+    def __iter__(self):
+        return iter((self.name, self.value))
+
+    def __repr__(self):
+        return 'Assignment({name!r}, {value!r}, line={line})'.format(name=self.name, value=self.value, line=self.line)
+
+
+class Document(object):
+    """
+    A parsed .blagh file. globals, variables and macros map $name$ to its
+    value, custom_tags maps a tag name to its contents, imports lists the
+    names in its <imports> block, and locations maps a tag name to the
+    (line, col) its contents start at.
+
+    Item access (doc['macros']) mirrors the attributes, so code written
+    against the old dict context keeps working.
+    """
+    __slots__ = ('globals', 'variables', 'macros', 'custom_tags', 'imports', 'locations')
+
+    def __init__(self, globals=None, variables=None, macros=None, custom_tags=None, imports=None, locations=None):
+        self.globals = {} if globals is None else globals
+        self.variables = {} if variables is None else variables
+        self.macros = {} if macros is None else macros
+        self.custom_tags = {} if custom_tags is None else custom_tags
+        self.imports = [] if imports is None else imports
+        self.locations = {} if locations is None else locations
+
+    @classmethod
+    def coerce(cls, ctx):
+        """returns ctx itself if it is a Document, else a Document sharing the dict's values"""
+        if isinstance(ctx, cls):
+            return ctx
+
+        return cls(**{ key: ctx[key] for key in cls.__slots__ if key in ctx })
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __repr__(self):
+        return 'Document(globals={g}, variables={v}, macros={m}, custom_tags={c})'.format(
+                g=len(self.globals), v=len(self.variables), m=len(self.macros), c=list(self.custom_tags))
@@ -0,0 +1,128 @@
+"""
+Lazy tracing and per-stage profiling.
+
+trace() only builds a log record (and so only formats its arguments)
+when the logger is enabled for DEBUG.
+
+stage() and iterate() time the pipeline's stages (lex, parse, expand,
+compile, write) once profiling is enabled, and are no-ops otherwise.
+Each stage's wall time, call count and peak bytes allocated (through
+tracemalloc) exclude the stages nested inside it.
+"""
+
+import json
+import time
+import logging
+import tracemalloc
+import contextlib
+
+
+STAGES = ('lex', 'parse', 'expand', 'compile', 'write')
+
+PROFILER = None
+
+
+def trace(logger, message, *args):
+    """logger.debug() that skips building the record entirely unless DEBUG is on"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, *args)
+
+
+class Profiler(object):
+    """accumulates per-stage self time, calls and peak allocation"""
+
+    def __init__(self):
+        self.stats = { name: { 'calls': 0, 'seconds': 0.0, 'bytes': 0 } for name in STAGES }
+        self.frames = []
+
+    def enter(self, name):
+        # the peak so far belongs to the enclosing stage; keep it before resetting
+        current, peak = tracemalloc.get_traced_memory()
+        if self.frames:
+            self.frames[-1]['peak'] = max(self.frames[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        self.frames.append({ 'name': name, 'start': time.perf_counter(), 'memory': current, 'peak': current, 'children': 0.0 })
+
+    def exit(self):
+        frame = self.frames.pop()
+        elapsed = time.perf_counter() - frame['start']
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, frame['peak'])
+        # so the enclosing stage's peak from here on excludes this one's
+        tracemalloc.reset_peak()
+
+        stats = self.stats.setdefault(frame['name'], { 'calls': 0, 'seconds': 0.0, 'bytes': 0 })
+        stats['calls'] += 1
+        stats['seconds'] += elapsed - frame['children']
+        stats['bytes'] += max(peak - frame['memory'], 0)
+
+        if self.frames:
+            parent = self.frames[-1]
+            parent['children'] += elapsed
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def iterate(self, name, iterable):
+        """yields from iterable, counting the time spent producing each item as stage name"""
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def report(self):
+        return { name: dict(stats) for name, stats in self.stats.items() }
+
+    def table(self):
+        lines = [ '{:<10}{:>8}{:>14}{:>16}'.format('stage', 'calls', 'wall (ms)', 'peak alloc (B)') ]
+        for name, stats in self.stats.items():
+            lines.append('{:<10}{:>8}{:>14.3f}{:>16}'.format(name, stats['calls'], stats['seconds'] * 1000, stats['bytes']))
+
+        return '\n'.join(lines)
+
+    def json(self):
+        return json.dumps(self.report(), indent=2)
+
+
+def enable():
+    """starts profiling (and tracemalloc) for the rest of the process, returning the Profiler"""
+    global PROFILER
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    PROFILER = Profiler()
+    return PROFILER
+
+
+def disable():
+    global PROFILER
+    PROFILER = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def stage(name):
+    """times a block as stage name, if profiling is enabled"""
+    if PROFILER is None:
+        return contextlib.nullcontext()
+
+    return PROFILER.stage(name)
+
+
+def iterate(name, iterable):
+    """times the production of each item as stage name, if profiling is enabled"""
+    if PROFILER is None:
+        return iterable
+
+    return PROFILER.iterate(name, iterable)
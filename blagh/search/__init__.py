@@ -0,0 +1,189 @@
+"""
+Builds a full-text search index for the site as static JSON files.
+
+Each post's expanded content tags are stripped of markup and split into
+lowercase terms. The inverted index is sharded by each term's first
+PREFIX_LENGTH characters, so a browser only fetches the shards for the
+terms it is looking up:
+
+<out-dir>/search/docs.json      := { id: [slug, title] }
+<out-dir>/search/<prefix>.json  := { term: [id, count, id, count, ...] }
+
+<out-dir>/.blagh-search.json remembers each post's id, content hash and
+shards, so a build only rewrites the shards holding terms of the posts
+it changed or removed.
+"""
+
+import os
+import re
+import json
+import html
+import shutil
+import logging
+import collections
+
+from blagh import tool, output
+
+
+logger = logging.getLogger('Search')
+
+
+DIRECTORY = 'search'
+STATE = '.blagh-search.json'
+STATE_VERSION = 1
+
+PREFIX_LENGTH = 2
+MIN_TERM_LENGTH = 2
+
+MARKUP = re.compile(r'<[^>]*>')
+WORD = re.compile(r'\w+')
+
+
+def tokenize(contents):
+    """yields the lowercase terms of an html string"""
+    text = html.unescape(MARKUP.sub(' ', contents)).lower()
+    for match in WORD.finditer(text):
+        if len(match.group(0)) >= MIN_TERM_LENGTH:
+            yield match.group(0)
+
+
+def count_terms(custom_tags):
+    """{ term: occurrences } across a post's expanded content tags"""
+    counts = collections.Counter()
+    for contents in custom_tags.values():
+        counts.update(tokenize(contents))
+
+    return dict(counts)
+
+
+def shard_of(term):
+    return term[:PREFIX_LENGTH]
+
+
+def dumps(payload):
+    return json.dumps(payload, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+
+
+class SearchIndex(object):
+    """the sharded index under out_dir, and the state needed to update it in place"""
+
+    def __init__(self, out_dir, writer=None):
+        self.out_dir = out_dir
+        self.directory = os.path.join(out_dir, DIRECTORY)
+        self.writer = writer or output.Writer()
+        self.reset = False
+        self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            with open(os.path.join(self.out_dir, STATE)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+
+        if state.get('version') != STATE_VERSION:
+            self.reset = True
+            return { 'version': STATE_VERSION, 'next_id': 0, 'docs': {} }
+
+        return state
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, shard + '.json')
+
+    def load_shard(self, shard):
+        try:
+            with open(self.shard_path(shard), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def changes(self, results):
+        """
+        { slug: (post, digest, title, terms) } for posts to (re)index, and
+        the set of every slug that should stay in the index
+        """
+        docs = self.state['docs']
+        changed = {}
+        present = set()
+
+        for result in results:
+            if result['status'] == 'skipped' or result.get('previous') == 'skipped':
+                continue
+
+            slug = os.path.relpath(result['output'], self.out_dir)
+            digest = (result['inputs'] or {}).get(os.path.abspath(result['post']))
+            if result['status'] == 'failed':
+                if slug in docs:
+                    present.add(slug)
+                continue
+
+            present.add(slug)
+            if result['status'] == 'unchanged' and slug in docs and docs[slug]['hash'] == digest:
+                continue
+
+            # an unchanged post only lacks its terms when the index fell behind its build
+            terms, globals = result.get('terms'), result.get('globals')
+            if terms is None:
+                expanded = tool.load_post(result['post'])
+                terms, globals = count_terms(expanded.custom_tags), expanded.globals
+            changed[slug] = (digest, (globals or {}).get('$title$'), terms)
+
+        return changed, present
+
+    def update(self, results):
+        """applies a build's result dicts, returning the number of index files rewritten"""
+        if self.reset:
+            # ids restart at 0 without the state, so shards from before would name the wrong posts
+            logger.info('update() -> no usable %s, reindexing everything', STATE)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.reset = False
+
+        docs = self.state['docs']
+        changed, present = self.changes(results)
+        removed = set(docs) - present
+        if not changed and not removed:
+            return 0
+
+        # every shard that held the old terms, or will hold the new terms, of a touched post
+        shards = collections.defaultdict(dict)
+        stale = set()
+        for slug in removed | set(changed):
+            if slug in docs:
+                stale.add(docs[slug]['id'])
+                for shard in docs[slug]['shards']:
+                    shards[shard]
+        for slug in removed:
+            del docs[slug]
+
+        for slug, (digest, title, terms) in changed.items():
+            if slug not in docs:
+                docs[slug] = { 'id': self.state['next_id'] }
+                self.state['next_id'] += 1
+            doc_id = docs[slug]['id']
+            docs[slug].update({ 'hash': digest, 'title': title, 'shards': sorted({ shard_of(t) for t in terms }) })
+            for term, count in terms.items():
+                shards[shard_of(term)].setdefault(term, []).append((doc_id, count))
+
+        written = 0
+        for shard, additions in shards.items():
+            postings = {}
+            for term, flat in self.load_shard(shard).items():
+                pairs = [ pair for pair in zip(flat[::2], flat[1::2]) if pair[0] not in stale ]
+                if pairs:
+                    postings[term] = pairs
+            for term, pairs in additions.items():
+                postings[term] = sorted(postings.get(term, []) + pairs)
+
+            if postings:
+                flat = { term: [ value for pair in pairs for value in pair ] for term, pairs in postings.items() }
+                written += self.writer.write_text(self.shard_path(shard), dumps(flat))
+            elif os.path.exists(self.shard_path(shard)):
+                os.remove(self.shard_path(shard))
+                written += 1
+
+        catalog = { str(doc['id']): [slug.replace(os.sep, '/'), doc['title']] for slug, doc in docs.items() }
+        written += self.writer.write_text(os.path.join(self.directory, 'docs.json'), dumps(catalog))
+        self.writer.write_text(os.path.join(self.out_dir, STATE), dumps(self.state))
+
+        logger.info('update() -> %d posts reindexed, %d removed, %d files rewritten', len(changed), len(removed), written)
+        return written
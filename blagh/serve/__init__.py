@@ -0,0 +1,174 @@
+"""
+Serves a site's posts straight from memory, for local preview.
+
+Usage: blagh serve <src-dir> -t <template> [--host <host>] [--port <port>]
+
+GET /<slug>/ renders the matching post through the lexer, parser,
+expansion and compiler stages. Rendered pages are kept in an LRU keyed
+by the content hashes of the post, the template and its imports, and
+sent with an ETag so unchanged pages answer If-None-Match with a 304.
+Nothing is written to disk, and requests are handled on threads.
+"""
+
+import os
+import html
+import hashlib
+import argparse
+import logging
+import http.server
+
+from blagh import tool, build, imports, compiler, cache
+from blagh.engine import LRUCache
+
+
+logger = logging.getLogger('Serve')
+
+
+DEFAULT_PORT = 8000
+DEFAULT_MAX_PAGES = 256
+
+
+class PageCache(LRUCache):
+    """a thread-safe LRU of key -> (etag, body)"""
+
+    def __init__(self, max_pages=DEFAULT_MAX_PAGES):
+        super().__init__(max_pages)
+
+
+class Site(object):
+    """renders a source directory's posts on demand"""
+
+    def __init__(self, src_dir, template_path, max_pages=DEFAULT_MAX_PAGES):
+        self.src_dir = src_dir
+        self.template_path = os.path.abspath(template_path)
+        self.pages = PageCache(max_pages)
+        self.templates = {}
+        self.dependencies = {}
+
+    def slugs(self):
+        """{ slug: post path } for every post under src_dir"""
+        return { build.post_slug(self.src_dir, post): os.path.abspath(post) for post in build.find_posts(self.src_dir) }
+
+    def find(self, path):
+        """the post a url path like /my-post/ refers to, or None"""
+        return self.slugs().get(path.split('?', 1)[0].strip('/'))
+
+    def template(self, digest):
+        """the CompiledTemplate for the template's current content"""
+        template = self.templates.get(digest)
+        if template is None:
+            template = compiler.CompiledTemplate(tool.load_file(self.template_path))
+            self.templates = { digest: template }
+
+        return template
+
+    def render(self, post):
+        """returns (etag, body) for a post, from the page cache when its inputs are unchanged"""
+        template_digest = cache.hash_file(self.template_path)
+        inputs = [post] + sorted(self.dependencies.get(post, ()))
+        key = (template_digest,) + tuple(cache.hash_file(p) if os.path.exists(p) else None for p in inputs)
+
+        page = self.pages.get(key)
+        if page is not None:
+            return page
+
+        expanded = tool.expand_post(post)
+        body = self.template(template_digest).render(expanded).encode('utf-8')
+
+        # remember what this post imports, so its next key covers those files too
+        self.dependencies[post] = [ p for p, _ in imports.dependencies(expanded, os.path.dirname(post), post) ]
+        inputs = [post] + sorted(self.dependencies[post])
+        key = (template_digest,) + tuple(cache.hash_file(p) for p in inputs)
+
+        page = ('"' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '"', body)
+        self.pages.put(key, page)
+        return page
+
+    def index(self):
+        """a plain listing of every post"""
+        links = ''.join('<li><a href="/{slug}/">{slug}</a></li>'.format(slug=html.escape(slug)) for slug in sorted(self.slugs()))
+        return '<!DOCTYPE html><html><body><ul>{links}</ul></body></html>'.format(links=links).encode('utf-8')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """GET / lists posts; GET /<slug>/ renders one"""
+
+    site = None
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        if self.path.split('?', 1)[0] == '/':
+            return self.send(200, self.site.index(), head=head)
+
+        post = self.site.find(self.path)
+        if post is None:
+            return self.send(404, b'Not Found', 'text/plain', head=head)
+
+        try:
+            etag, body = self.site.render(post)
+        except Exception as e:
+            logger.warning('respond() -> error rendering %s: %s', post, e)
+            return self.send(500, str(e).encode('utf-8'), 'text/plain', head=head)
+
+        if etag in [ tag.strip() for tag in self.headers.get('If-None-Match', '').split(',') ]:
+            return self.send(304, b'', etag=etag, head=True)
+
+        self.send(200, body, etag=etag, head=head)
+
+    def send(self, status, body, content_type='text/html; charset=utf-8', etag=None, head=False):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(format, *args)
+
+
+def make_server(site, host='127.0.0.1', port=DEFAULT_PORT):
+    """a threaded http server for site"""
+    handler = type('SiteHandler', (Handler,), { 'site': site })
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="blagh serve", description="preview posts rendered from memory")
+
+    parser.add_argument("src_dir", help="the directory of .blagh files to serve")
+    parser.add_argument("-t", "--template", help="the template to compile each file against", required=True)
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="the port to listen on")
+    parser.add_argument("--max-pages", type=int, default=DEFAULT_MAX_PAGES, help="rendered pages to keep in memory")
+    parser.add_argument("--debug", action="store_true", help="set to debug mode")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    parsed_args = parse_arguments(argv)
+    if parsed_args.debug == True:
+        logging.basicConfig(level=logging.DEBUG, format="%(name)s:[%(levelname)s]: %(message)s")
+
+    server = make_server(Site(parsed_args.src_dir, parsed_args.template, parsed_args.max_pages), parsed_args.host, parsed_args.port)
+    print('serving {src} on http://{host}:{port}/'.format(src=parsed_args.src_dir, host=parsed_args.host, port=server.server_address[1]))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.server_close()
@@ -3,6 +3,9 @@
 """
 Template engine for my Github Pages blog posts.
 Usage: blagh -f <file> -t <template>
+       blagh build <src-dir> -t <template> -o <out-dir>
+       blagh watch <src-dir> -t <template> -o <out-dir>
+       blagh serve <src-dir> -t <template>
 
 It will create a folder and an index.html for the post, using
 a template html and a json file to compile the post.
@@ -15,17 +18,21 @@ File Rules:
 - File must follow the minimal rules in the README (github.com/ammarm08/blagh)
 """
 
-import lexer, parser, expansion, compiler
+from blagh import lexer, parser, imports, expansion, compiler, cache, output, profiling
 
 import os
 import re
+import sys
 import argparse
 import logging
+import importlib
 
 # set up basic debugging logger
 
 LOGGER = logging.getLogger("[BLAGH]")
 
+COMMANDS = ("build", "watch", "serve")
+
 
 
 def load_file(filename):
@@ -38,23 +45,43 @@ def load_file(filename):
         raise e
 
 
+def open_file(filename):
+    """open() wrapper for streaming reads"""
+    try:
+        return open(filename)
+    except Exception as e:
+        LOGGER.warn("open_file() -> error opening file from %s", filename)
+        raise e
+
+
 def create_directory(dirname):
+    """mkdir -p"""
     try:
-        os.mkdir(dirname)
+        os.makedirs(dirname, exist_ok=True)
     except OSError as e:
         LOGGER.warn("create_directory() -> error creating dir %s", dirname)
         raise e
 
 
-def write_file(path, contents):
+def write_file(path, contents, writer=None):
+    """atomically writes contents to path unless it already holds them; returns whether it wrote"""
     try:
-        with open(path, "w+") as f:
-            f.write(contents)
+        return (writer or output.Writer()).write_text(path, contents)
     except Exception as e:
         LOGGER.warn("write_file() -> error creating file %s", path)
         raise e
 
 
+def stream_file(path, template, tags, writer=None):
+    """renders template with tags straight into path, atomically and only if changed; returns whether it wrote"""
+    try:
+        with profiling.stage('write'):
+            return (writer or output.Writer()).write(path, profiling.iterate('compile', template.iter_render(tags)))
+    except Exception as e:
+        LOGGER.warn("stream_file() -> error creating file %s", path)
+        raise e
+
+
 def sluggify(title):
     """creates a slug from a title -- lowercased and dash-delimited"""
     slugged = re.sub(r"(\s+)", "-", title.lower())
@@ -62,50 +89,132 @@ def sluggify(title):
     return stripped
 
 
-def write_blog_post(html, dirname):
-    """ mkdir() and touch() the blog post """
+def write_blog_post(html, dirname, writer=None):
+    """ mkdir -p and write the blog post's index.html, if it changed """
     LOGGER.info("write_blog_post() -> writing %s", dirname)
 
-    create_directory(dirname)
-    write_file(dirname + "/index.html", html)
+    written = write_file(os.path.join(dirname, "index.html"), html, writer)
 
-    LOGGER.info("write_blog_post() -> successfully wrote %s", dirname)
+    LOGGER.info("write_blog_post() -> %s %s", "successfully wrote" if written else "left unchanged", dirname)
+    return written
 
 
-def parse_arguments():
-    parser = argparse.ArgumentParser()
+def expand_post(filename, workers=None):
+    """lex, parse, resolve imports and expand a .blagh file"""
 
-    parser.add_argument("-f", "--file", help="the file to compile", required=True)
-    parser.add_argument("-t", "--template", help="the template to compile the file against", required=True)
-    parser.add_argument("--debug", action="store_true", help="set to debug mode")
+    # lex the file's tag sections (globals, macros, etc) as they stream in
+    with open_file(filename) as blagh_file, profiling.stage('parse'):
+        parsed_tags = parser.parse(profiling.iterate('lex', lexer.scan_stream(blagh_file)))
+        imports.resolve(parsed_tags, os.path.dirname(os.path.abspath(filename)), filename)
+
+    # inject all variables into content sections
+    with profiling.stage('expand'):
+        return expansion.expand(parsed_tags, workers)
+
+
+def load_post(filename, artifacts=None, workers=None):
+    """expand_post(), reusing the cached artifact if the post and its imports are unchanged"""
+    if artifacts is None:
+        return expand_post(filename, workers)
+
+    digest = cache.hash_file(filename)
+    expanded = artifacts.load_post(filename, digest)
+    if expanded is None:
+        expanded = expand_post(filename, workers)
+        dependencies = imports.dependencies(expanded, os.path.dirname(os.path.abspath(filename)), filename)
+        artifacts.store_post(filename, digest, expanded, dependencies)
+    else:
+        LOGGER.info("load_post() -> using cached artifact for %s", filename)
+
+    return expanded
 
-    return parser.parse_args()
 
+def load_template(filename, artifacts=None):
+    """loads a CompiledTemplate, reusing the cached artifact if unchanged"""
+    if artifacts is None:
+        html = load_file(filename)
+        with profiling.stage('compile'):
+            return compiler.CompiledTemplate(html)
 
-def main():
-    parsed_args = parse_arguments()
+    digest = cache.hash_file(filename)
+    segments = artifacts.load_template(digest)
+    if segments is None:
+        html = load_file(filename)
+        with profiling.stage('compile'):
+            template = compiler.CompiledTemplate(html)
+        artifacts.store_template(digest, template.segments)
+        return template
+
+    return compiler.CompiledTemplate.from_segments(segments)
+
+
+def stream_blog_post(template, tags, dirname, writer=None):
+    """ mkdir -p and render the blog post into its index.html, if it changed """
+    LOGGER.info("stream_blog_post() -> writing %s", dirname)
+
+    written = stream_file(os.path.join(dirname, "index.html"), template, tags, writer)
+
+    LOGGER.info("stream_blog_post() -> %s %s", "successfully wrote" if written else "left unchanged", dirname)
+    return written
+
+
+def add_common_arguments(parser):
+    """debug and artifact cache options shared by every command"""
+    parser.add_argument("--debug", action="store_true", help="set to debug mode")
+    parser.add_argument("--cache-dir", help="where to keep compiled .blaghc artifacts (default: ~/.cache/blagh)")
+    parser.add_argument("--cache-size", type=int, default=cache.DEFAULT_MAX_BYTES // (1024 * 1024), help="cache size cap in MB")
+    parser.add_argument("--no-cache", action="store_true", help="always recompile, without reading or writing artifacts")
+
+
+def configure(parsed_args):
+    """applies common options, returning the artifact cache to use (or None)"""
     if parsed_args.debug == True:
         logging.basicConfig(level=logging.DEBUG, format="%(name)s:[%(levelname)s]: %(message)s")
 
+    if parsed_args.no_cache:
+        return None
 
-    # 1. read .blagh file and .html template
-    blagh_file = load_file(parsed_args.file)
-    html_template = load_file(parsed_args.template)
+    return cache.ArtifactCache(parsed_args.cache_dir, parsed_args.cache_size * 1024 * 1024)
 
-    # 2. lex the file's tag sections (globals, macros, etc)
-    lexed = lexer.scan(blagh_file)
 
-    # 3. parse each section and inject all variables into content sections
-    parsed_tags = parser.parse(lexed)
-    expanded_content = expansion.expand(parsed_tags)
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(epilog="other commands: " + ", ".join(COMMANDS))
 
-    # 4. compile html from the parsed .blagh file
-    html = compiler.compile(expanded_content, html_template)
+    parser.add_argument("-f", "--file", help="the file to compile", required=True)
+    parser.add_argument("-t", "--template", help="the template to compile the file against", required=True)
+    parser.add_argument("--workers", type=int, help="expand large posts' content tags across this many processes")
+    parser.add_argument("--profile", nargs="?", const="table", choices=("table", "json"),
+                        help="report time, calls and peak allocation per stage (lex, parse, expand, compile, write); combine with --no-cache to profile every stage")
+    add_common_arguments(parser)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        # imported here because the commands are themselves built on this module
+        command = importlib.import_module("blagh." + argv[0])
+        return command.main(argv[1:])
 
-    # 5. write html to disk
+    parsed_args = parse_arguments(argv)
+    artifacts = configure(parsed_args)
+    profiler = profiling.enable() if parsed_args.profile else None
+
+    # 1. load the .html template, compiled into literals and $slots$
+    template = load_template(parsed_args.template, artifacts)
+
+    # 2. lex, parse and expand the .blagh file (or load its cached artifact)
+    expanded_content = load_post(parsed_args.file, artifacts, parsed_args.workers)
+
+    # 3. compile html from the parsed .blagh file, streaming it to disk
     dirname = sluggify(parsed_args.file)
-    write_blog_post(html, dirname)
+    stream_blog_post(template, expanded_content, dirname)
+
+    if profiler is not None:
+        print(profiler.json() if parsed_args.profile == "json" else profiler.table())
+        profiling.disable()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
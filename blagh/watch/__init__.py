@@ -0,0 +1,248 @@
+"""
+Watches a site's sources and re-renders only the posts an edit affects.
+
+Usage: blagh watch <src-dir> -t <template> -o <out-dir> [--interval <seconds>] [--poll]
+
+The template, import resolver and macro tables stay warm in this
+process between edits. A post is re-rendered when it changes or when
+anything it imports changes; every post is re-rendered when the
+template changes; a template that fails to load is reported and the
+last good one kept until it loads again. Changes are detected with inotify where the platform
+has it (through ctypes), else by polling modification times.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+import argparse
+import logging
+
+from blagh import tool, build
+
+
+logger = logging.getLogger('Watch')
+
+
+DEFAULT_INTERVAL = 0.5
+
+# let an editor finish writing before reading what it wrote
+DEBOUNCE = 0.05
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class PollingWaiter(object):
+    """waits out the polling interval"""
+
+    def wait(self, directories, timeout):
+        time.sleep(timeout)
+
+
+class InotifyWaiter(object):
+    """wakes up as soon as inotify reports activity in a watched directory"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1() failed')
+        self.watched = set()
+
+    def watch(self, directories):
+        for directory in directories - self.watched:
+            if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MASK) >= 0:
+                self.watched.add(directory)
+
+    def wait(self, directories, timeout):
+        self.watch(directories)
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+
+        time.sleep(DEBOUNCE)
+        while True:
+            try:
+                os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+
+def make_waiter(poll=False):
+    """an InotifyWaiter where available, else a PollingWaiter"""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWaiter()
+        except (OSError, AttributeError) as e:
+            logger.info('make_waiter() -> inotify unavailable (%s), polling instead', e)
+
+    return PollingWaiter()
+
+
+def stat_key(path):
+    """(mtime, size) of a file, or None if it is gone"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class Watcher(object):
+    """
+    Rebuilds a site's affected posts on each poll(). dependencies maps
+    each post to every input its last build read, so an edit to a
+    shared import re-renders just the posts that import it.
+    """
+
+    def __init__(self, src_dir, template_path, out_dir, artifacts=None):
+        self.src_dir = src_dir
+        self.template_path = os.path.abspath(template_path)
+        self.out_dir = out_dir
+        self.artifacts = artifacts
+        self.snapshot = {}
+        self.dependencies = {}
+        # posts whose last render failed; their inputs (eg an import that
+        # does not exist yet) are unknown, so they are retried on any change
+        self.failed = set()
+        # set while the template fails to load; the last good one is
+        # kept, and loading it is retried on any change
+        self.template_error = None
+
+    def paths(self):
+        """every file whose changes matter: posts, the template, and known imports"""
+        paths = { os.path.abspath(p) for p in build.find_posts(self.src_dir) }
+        paths.add(self.template_path)
+        for inputs in self.dependencies.values():
+            paths.update(inputs)
+
+        return paths
+
+    def directories(self):
+        """the directories holding every watched path, plus the source tree"""
+        directories = { os.path.dirname(p) for p in self.paths() }
+        for root, _, _ in os.walk(self.src_dir):
+            directories.add(os.path.abspath(root))
+
+        return directories
+
+    def changes(self):
+        """paths added, removed or modified since the last call"""
+        snapshot = { path: stat_key(path) for path in self.paths() }
+        changed = { path for path in set(snapshot) | set(self.snapshot) if snapshot.get(path) != self.snapshot.get(path) }
+        self.snapshot = snapshot
+
+        return changed
+
+    def affected(self, changed):
+        """the posts (that still exist) to re-render for a set of changed paths"""
+        posts = [ os.path.abspath(p) for p in build.find_posts(self.src_dir) ]
+        if self.template_path in changed:
+            return posts
+
+        return [ p for p in posts if p in changed or p in self.failed or changed & self.dependencies.get(p, set()) ]
+
+    def poll(self):
+        """re-renders whatever changed since the last poll, returning build results with timings"""
+        changed = self.changes()
+        if not changed:
+            return []
+
+        edited_at = max([ os.stat(p).st_mtime for p in changed if os.path.exists(p) ] or [time.time()])
+
+        results = []
+        if self.template_path in changed or self.template_error:
+            try:
+                build.init_worker(self.template_path, self.artifacts)
+            except Exception as e:
+                logger.info('poll() -> template %s failed: %s', self.template_path, e)
+                self.template_error = '{kind}: {error}'.format(kind=type(e).__name__, error=e)
+                results.append({ 'post': self.template_path, 'output': None, 'status': 'failed', 'error': self.template_error, 'inputs': None, 'written': False, 'globals': None, 'terms': None })
+                changed = changed - { self.template_path }
+            else:
+                if self.template_error:
+                    changed = changed | { self.template_path }
+                self.template_error = None
+
+        for post in self.affected(changed):
+            start = time.perf_counter()
+            result = build.build_post(post, build.output_dir(self.src_dir, post, self.out_dir))
+            result['seconds'] = time.perf_counter() - start
+            result['latency'] = time.time() - edited_at
+
+            if result['inputs']:
+                self.dependencies[post] = set(result['inputs'])
+            if result['status'] == 'failed':
+                self.failed.add(post)
+            else:
+                self.failed.discard(post)
+            results.append(result)
+
+        for post in list(self.dependencies):
+            if post in changed and not os.path.exists(post):
+                del self.dependencies[post]
+        self.failed = { post for post in self.failed if os.path.exists(post) }
+
+        return results
+
+    def run(self, waiter, interval=DEFAULT_INTERVAL, report=print):
+        """builds everything, then re-renders affected posts on every change until interrupted"""
+        build.init_worker(self.template_path, self.artifacts)
+        self.snapshot = {}
+        report(build.summarize(self.poll()))
+
+        while True:
+            waiter.wait(self.directories(), interval)
+            for result in self.poll():
+                report(describe(result))
+
+
+def describe(result):
+    """one line per re-rendered post"""
+    if result['status'] == 'failed':
+        return '{post}: {error}'.format(**result)
+
+    status = result['status']
+    if status == 'built' and not result['written']:
+        status = 'built (identical to disk)'
+
+    return '{post}: {status} in {render:.1f} ms ({latency:.1f} ms after edit)'.format(
+            post=result['post'], status=status, render=result['seconds'] * 1000, latency=result['latency'] * 1000)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="blagh watch", description="re-render posts as their sources change")
+
+    parser.add_argument("src_dir", help="the directory of .blagh files to watch")
+    parser.add_argument("-t", "--template", help="the template to compile each file against", required=True)
+    parser.add_argument("-o", "--out", help="the directory to write posts to", required=True)
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between checks when polling")
+    parser.add_argument("--poll", action="store_true", help="poll modification times even where inotify is available")
+    tool.add_common_arguments(parser)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    parsed_args = parse_arguments(argv)
+    artifacts = tool.configure(parsed_args)
+
+    watcher = Watcher(parsed_args.src_dir, parsed_args.template, parsed_args.out, artifacts)
+    try:
+        watcher.run(make_waiter(parsed_args.poll), parsed_args.interval)
+    except KeyboardInterrupt:
+        return 0
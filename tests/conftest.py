@@ -0,0 +1,13 @@
+import pytest
+
+@pytest.fixture
+def make_site(tmpdir):
+    """writes posts ({ path under src: source }) into tmpdir/src and template to tmpdir/template.html, returning src"""
+    def make(posts, template):
+        src = tmpdir.mkdir('src')
+        for path, source in posts.items():
+            src.join(path).write(source, ensure=True)
+        tmpdir.join('template.html').write(template)
+        return src
+
+    return make
@@ -0,0 +1,177 @@
+import os
+import gzip
+import asyncio
+import pytest
+import blagh
+from blagh import build, tool
+
+TEMPLATE = '<title>$title$</title><main>$content$</main>'
+
+SITE = {
+    'macros.blagh': '<macros>\n$box$ := <div>{}</div>\n</macros>',
+    'first-post.blagh': '<imports>$macros$</imports>\n<globals>\n$title$ := First\n</globals>\n<content><box>one</box></content>',
+    'drafts/second.blagh': '<globals>\n$title$ := Second\n</globals>\n<content>two</content>',
+    'broken.blagh': '<content>never closed',
+}
+
+class TestBuild(object):
+
+
+
+    # Site Build Tests
+
+
+
+    def test_finds_posts_recursively_in_order(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        posts = [ os.path.relpath(p, str(src)) for p in build.find_posts(str(src)) ]
+        assert posts == ['broken.blagh', 'first-post.blagh', 'macros.blagh', os.path.join('drafts', 'second.blagh')]
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_builds_site_and_reports_failures(self, tmpdir, make_site, jobs):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+
+        results = build.build(str(src), str(tmpdir.join('template.html')), str(out), jobs=jobs)
+        statuses = { os.path.basename(r['post']): r['status'] for r in results }
+
+        assert statuses == { 'broken.blagh': 'failed', 'first-post.blagh': 'built', 'macros.blagh': 'skipped', 'second.blagh': 'built' }
+        assert out.join('first-post', 'index.html').read() == '<title>First</title><main><div>one</div></main>'
+        assert out.join('drafts', 'second', 'index.html').read() == '<title>Second</title><main>two</main>'
+        assert not out.join('macros').exists()
+        assert 'failed 1' in build.summarize(results)
+
+    @pytest.mark.parametrize('use_async', [False, True])
+    def test_slugs_file_names_and_fails_colliding_posts(self, tmpdir, make_site, use_async):
+        src = make_site({
+            'v2.0/intro.blagh': '<content>intro</content>',
+            'setup.blagh': '<content>setup</content>',
+            'My Post.blagh': '<content>upper</content>',
+            'my post.blagh': '<content>lower</content>',
+        }, TEMPLATE)
+        out = tmpdir.join('out')
+
+        args = (str(src), str(tmpdir.join('template.html')), str(out))
+        results = asyncio.run(build.build_async(*args, jobs=1)) if use_async else build.build(*args, jobs=1)
+        statuses = { os.path.relpath(r['post'], str(src)): r['status'] for r in results }
+
+        assert statuses == { 'My Post.blagh': 'failed', 'my post.blagh': 'failed', 'setup.blagh': 'built', os.path.join('v2.0', 'intro.blagh'): 'built' }
+        assert all('shared by' in r['error'] for r in results if r['status'] == 'failed')
+        assert out.join('v2.0', 'intro', 'index.html').read().endswith('<main>intro</main>')
+        assert out.join('setup', 'index.html').read().endswith('<main>setup</main>')
+        assert not out.join('my-post').exists()
+
+    def test_cli_dispatches_build_command(self, tmpdir, make_site, capsys):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+
+        status = tool.main(['build', str(src), '-t', str(tmpdir.join('template.html')), '-o', str(out), '-j', '1', '--no-cache'])
+        assert status == 1
+        assert 'built 2, unchanged 0, skipped 1, failed 1' in capsys.readouterr().out
+
+    def test_incremental_build_skips_unchanged_posts(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        template = str(tmpdir.join('template.html'))
+        out = tmpdir.join('out')
+
+        def statuses():
+            results = build.build(str(src), template, str(out), jobs=1, incremental=True)
+            return { os.path.basename(r['post']): r['status'] for r in results }
+
+        assert statuses()['first-post.blagh'] == 'built'
+        assert statuses() == { 'broken.blagh': 'failed', 'first-post.blagh': 'unchanged', 'macros.blagh': 'unchanged', 'second.blagh': 'unchanged' }
+
+        # an import changing rebuilds the posts that import it
+        src.join('macros.blagh').write('<macros>\n$box$ := <section>{}</section>\n</macros>')
+        rebuilt = statuses()
+        assert rebuilt['first-post.blagh'] == 'built'
+        assert rebuilt['second.blagh'] == 'unchanged'
+        assert out.join('first-post', 'index.html').read() == '<title>First</title><main><section>one</section></main>'
+
+        # so does the template changing, or an output going missing
+        tmpdir.join('template.html').write(TEMPLATE + '\n')
+        assert set(statuses().values()) == { 'built', 'skipped', 'failed' }
+        out.join('drafts', 'second', 'index.html').remove()
+        assert statuses()['second.blagh'] == 'built'
+
+
+
+    # Async Build Tests
+
+
+
+    def test_async_build_matches_sync_build(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        template = str(tmpdir.join('template.html'))
+
+        results = asyncio.run(blagh.build_async(str(src), template, str(tmpdir.join('out')), jobs=2, max_pending=1))
+        statuses = { os.path.basename(r['post']): r['status'] for r in results }
+
+        assert statuses == { 'broken.blagh': 'failed', 'first-post.blagh': 'built', 'macros.blagh': 'skipped', 'second.blagh': 'built' }
+        assert tmpdir.join('out', 'first-post', 'index.html').read() == '<title>First</title><main><div>one</div></main>'
+
+        sync = build.build(str(src), template, str(tmpdir.join('sync')), jobs=1)
+        assert sorted((r['post'], r['inputs']) for r in results if r['inputs']) == sorted((r['post'], r['inputs']) for r in sync if r['inputs'])
+
+        incremental = asyncio.run(blagh.build_async(str(src), template, str(tmpdir.join('out')), jobs=2, incremental=True))
+        assert { r['status'] for r in incremental } == { 'unchanged', 'failed' }
+
+    def test_async_build_stops_when_iteration_is_closed(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+
+        async def first():
+            results = build.iter_build_async(str(src), str(tmpdir.join('template.html')), str(tmpdir.join('out')), jobs=1, max_pending=1)
+            result = await results.__anext__()
+            await results.aclose()
+            return result
+
+        assert asyncio.run(first())['status'] in ('built', 'skipped', 'failed')
+        assert not tmpdir.join('out', build.MANIFEST).exists()
+
+    def test_async_build_holds_at_most_max_pending_posts(self, tmpdir, make_site, monkeypatch):
+        src = make_site(SITE, TEMPLATE)
+        for n in range(8):
+            src.join('extra-{n}.blagh'.format(n=n)).write('<content>{n}</content>'.format(n=n))
+
+        reads = []
+        read_post = build.read_post
+        monkeypatch.setattr(build, 'read_post', lambda post: reads.append(post) or read_post(post))
+
+        async def stall():
+            results = build.iter_build_async(str(src), str(tmpdir.join('template.html')), str(tmpdir.join('out')), jobs=1, max_pending=2)
+            await results.__anext__()
+            await asyncio.sleep(0.5)
+            await results.aclose()
+
+        asyncio.run(stall())
+        assert len(reads) == 3
+
+    def test_cli_builds_asynchronously(self, tmpdir, make_site, capsys):
+        src = make_site(SITE, TEMPLATE)
+
+        tool.main(['build', str(src), '-t', str(tmpdir.join('template.html')), '-o', str(tmpdir.join('out')), '-j', '2', '--async', '--no-cache'])
+        assert 'built 2, unchanged 0, skipped 1, failed 1' in capsys.readouterr().out
+
+    @pytest.mark.parametrize('use_async', [False, True])
+    def test_minifies_and_gzips_pages(self, tmpdir, make_site, use_async):
+        src = make_site(SITE, TEMPLATE)
+        tmpdir.join('template.html').write('<html>\n  <title>$title$</title>\n  <main>$content$</main>\n</html>\n')
+        arguments = (str(src), str(tmpdir.join('template.html')), str(tmpdir.join('out')), 2)
+
+        if use_async:
+            asyncio.run(build.build_async(*arguments, minify=True, compress=True))
+        else:
+            build.build(*arguments, minify=True, compress=True)
+
+        page = tmpdir.join('out', 'first-post', 'index.html')
+        assert page.read() == '<html> <title>First</title> <main><div>one</div></main> </html>'
+        assert gzip.decompress(tmpdir.join('out', 'first-post', 'index.html.gz').read_binary()) == page.read_binary()
+
+    def test_changing_options_rebuilds_incrementally(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        arguments = (str(src), str(tmpdir.join('template.html')), str(tmpdir.join('out')), 1)
+
+        build.build(*arguments, incremental=True)
+        results = build.build(*arguments, incremental=True, compress=True)
+        assert 'unchanged' not in { r['status'] for r in results }
+        assert tmpdir.join('out', 'first-post', 'index.html.gz').exists()
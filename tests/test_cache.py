@@ -0,0 +1,88 @@
+import os
+import pytest
+from blagh import cache, tool, parser
+
+POST = '<imports>$shared$</imports>\n<variables>\n$x$ := y\n</variables>\n<content>$x$ $z$</content>'
+
+class TestCache(object):
+
+
+
+    # Artifact Format Tests
+
+
+
+    def test_round_trips_payloads(self):
+        payload = { 'segments': ['<b>', '$x$', '</b>'] }
+        data = cache.dumps(payload)
+        assert data.startswith(cache.MAGIC)
+        assert cache.loads(data) == payload
+
+    def test_rejects_foreign_data(self):
+        with pytest.raises(Exception):
+            cache.loads(b'not an artifact')
+
+
+
+    # Artifact Cache Tests
+
+
+
+    def test_reuses_post_until_it_changes(self, tmpdir):
+        tmpdir.join('shared.blagh').write('<variables>\n$z$ := w\n</variables>')
+        post = tmpdir.join('post.blagh')
+        post.write(POST)
+        artifacts = cache.ArtifactCache(str(tmpdir.join('cache')))
+
+        expanded = tool.load_post(str(post), artifacts)
+        assert expanded.custom_tags == { 'content': 'y w' }
+
+        cached = artifacts.load_post(str(post), cache.hash_file(str(post)))
+        assert isinstance(cached, parser.Document)
+        assert cached.custom_tags == { 'content': 'y w' }
+
+        post.write(POST.replace('$x$ $z$', '$z$'))
+        assert artifacts.load_post(str(post), cache.hash_file(str(post))) is None
+        assert tool.load_post(str(post), artifacts).custom_tags == { 'content': 'w' }
+
+    def test_invalidates_post_when_an_import_changes(self, tmpdir):
+        shared = tmpdir.join('shared.blagh')
+        shared.write('<variables>\n$z$ := w\n</variables>')
+        post = tmpdir.join('post.blagh')
+        post.write(POST)
+        artifacts = cache.ArtifactCache(str(tmpdir.join('cache')))
+
+        tool.load_post(str(post), artifacts)
+        shared.write('<variables>\n$z$ := changed\n</variables>')
+
+        assert artifacts.load_post(str(post), cache.hash_file(str(post))) is None
+        assert tool.load_post(str(post), artifacts).custom_tags == { 'content': 'y changed' }
+
+    def test_evicts_least_recently_used_artifacts(self, tmpdir):
+        artifacts = cache.ArtifactCache(str(tmpdir), max_bytes=10 ** 9)
+        paths = [ artifacts.path_for('template', str(n)) for n in range(3) ]
+        for n, path in enumerate(paths):
+            artifacts.put(path, { 'segments': ['x' * 1000] })
+            os.utime(path, (n, n))
+
+        size = os.path.getsize(paths[0])
+        artifacts.max_bytes = 2 * size
+        artifacts.evict()
+
+        assert [ os.path.exists(p) for p in paths ] == [False, True, True]
+
+    def test_scans_directory_only_when_over_the_cap(self, tmpdir, monkeypatch):
+        artifacts = cache.ArtifactCache(str(tmpdir), max_bytes=10 ** 9)
+        scans = []
+        scan = artifacts.artifacts
+        monkeypatch.setattr(artifacts, 'artifacts', lambda: scans.append(1) or scan())
+
+        for n in range(50):
+            artifacts.put(artifacts.path_for('template', str(n)), { 'segments': [str(n)] })
+        assert len(scans) == 1
+
+        artifacts.max_bytes = artifacts.size // 2
+        artifacts.put(artifacts.path_for('template', 'last'), { 'segments': ['last'] })
+        assert len(scans) == 2
+        assert artifacts.size <= artifacts.max_bytes
+        assert artifacts.size == sum(os.path.getsize(str(p)) for p in tmpdir.listdir())
@@ -0,0 +1,131 @@
+import pytest
+from blagh import build, catalog, tool
+
+TEMPLATE = '<main>$content$</main>'
+
+SITE = {
+    'post-1.blagh': '<globals>\n$title$ := Post 1\n$date$ := 2020-01-01\n</globals>\n<content>1</content>',
+    'post-2.blagh': '<globals>\n$title$ := Post 2\n$date$ := 2020-01-02\n</globals>\n<content>2</content>',
+    'post-3.blagh': '<globals>\n$title$ := Post 3\n$date$ := 2020-01-03\n</globals>\n<content>3</content>',
+    'macros.blagh': '<macros>\n$box$ := <div>{}</div>\n</macros>',
+}
+
+UNDATED = '<globals>\n$title$ := Undated\n</globals>\n<content>x</content>'
+
+def titles(out):
+    with catalog.Catalog.open(str(out)) as index:
+        return [ row['title'] for row in index.posts() ]
+
+class TestCatalog(object):
+
+
+
+    # Index Tests
+
+
+
+    def test_build_indexes_post_globals(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        build.build(str(src), str(tmpdir.join('template.html')), str(out), jobs=1)
+
+        with catalog.Catalog.open(str(out)) as index:
+            rows = index.posts()
+            assert [ (r['slug'], r['title'], r['date']) for r in rows ] == [
+                ('post-3', 'Post 3', '2020-01-03'), ('post-2', 'Post 2', '2020-01-02'), ('post-1', 'Post 1', '2020-01-01') ]
+            assert rows[0]['hash'] is not None
+
+    def test_index_updates_incrementally(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        template = str(tmpdir.join('template.html'))
+        build.build(str(src), template, str(out), jobs=1, incremental=True)
+
+        src.join('post-2.blagh').write('<globals>\n$title$ := Renamed\n$date$ := 2020-01-02\n</globals>\n<content>2</content>')
+        src.join('post-3.blagh').remove()
+        build.build(str(src), template, str(out), jobs=1, incremental=True)
+        assert titles(out) == ['Renamed', 'Post 1']
+
+        # an unchanged post missing from a deleted index is parsed once to restore it
+        out.join(catalog.DATABASE).remove()
+        results = build.build(str(src), template, str(out), jobs=1, incremental=True)
+        assert { r['status'] for r in results } == { 'unchanged' }
+        assert titles(out) == ['Renamed', 'Post 1']
+
+
+
+    # Listing Page Tests
+
+
+
+    def test_generates_pages_archive_and_feed(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        build.build(str(src), str(tmpdir.join('template.html')), str(out), jobs=1)
+
+        with catalog.Catalog.open(str(out)) as index:
+            assert catalog.generate(index, str(out), base_url='https://example.com/blog', site_title='Blog', per_page=2) == 4
+
+        first = out.join('index.html').read()
+        assert first.index('Post 3') < first.index('Post 2') and 'Post 1' not in first
+        assert 'href="https://example.com/blog/page/2/"' in first
+        assert 'Post 1' in out.join('page', '2', 'index.html').read()
+        assert '<h2>2020</h2>' in out.join('archive', 'index.html').read()
+
+        feed = out.join('feed.xml').read()
+        assert '<updated>2020-01-03T00:00:00Z</updated>' in feed
+        assert feed.count('<entry>') == 3
+        assert '<id>https://example.com/blog/post-1/</id>' in feed
+
+    def test_cli_writes_listings(self, tmpdir, make_site, capsys):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        tmpdir.join('listing.html').write('<h1>$title$</h1>$posts$')
+
+        tool.main(['build', str(src), '-t', str(tmpdir.join('template.html')), '-o', str(out), '-j', '1', '--no-cache',
+                   '--listings', '--listing-template', str(tmpdir.join('listing.html')), '--site-title', 'Blog'])
+
+        assert out.join('index.html').read().startswith('<h1>Blog</h1><ul><li><time>2020-01-03</time>')
+        assert out.join('feed.xml').exists()
+
+    @pytest.mark.parametrize('name', ['archive', 'page'])
+    def test_refuses_to_overwrite_colliding_posts(self, tmpdir, make_site, capsys, name):
+        src = make_site(SITE, TEMPLATE)
+        src.join(name + '.blagh').write('<content>mine</content>')
+        out = tmpdir.join('out')
+
+        status = tool.main(['build', str(src), '-t', str(tmpdir.join('template.html')), '-o', str(out), '-j', '1', '--no-cache', '--listings'])
+
+        assert status == 1
+        assert 'overwrite the posts at ' + name in capsys.readouterr().err
+        assert out.join(name, 'index.html').read() == '<main>mine</main>'
+        assert not out.join('index.html').exists()
+
+    def test_feed_dates_undated_posts_by_when_they_were_indexed(self, tmpdir, make_site):
+        src = make_site({ 'undated.blagh': UNDATED }, TEMPLATE)
+        out = tmpdir.join('out')
+        build.build(str(src), str(tmpdir.join('template.html')), str(out), jobs=1)
+
+        with catalog.Catalog.open(str(out)) as index:
+            indexed = index.posts()[0]['indexed']
+            catalog.generate(index, str(out))
+
+        feed = out.join('feed.xml').read()
+        assert feed.count('<updated>{indexed}</updated>'.format(indexed=indexed)) == 2
+
+    def test_full_rebuilds_keep_the_feed_unchanged(self, tmpdir, make_site, monkeypatch):
+        src = make_site({ 'undated.blagh': UNDATED }, TEMPLATE)
+        out = tmpdir.join('out')
+
+        def feed(now):
+            monkeypatch.setattr(catalog, 'timestamp', lambda: now)
+            build.build(str(src), str(tmpdir.join('template.html')), str(out), jobs=1)
+            with catalog.Catalog.open(str(out)) as index:
+                catalog.generate(index, str(out))
+            return out.join('feed.xml').read()
+
+        first = feed('2020-01-01T00:00:00Z')
+        assert feed('2020-01-02T00:00:00Z') == first
+
+        src.join('undated.blagh').write(UNDATED.replace('<content>x', '<content>y'))
+        assert '2020-01-03T00:00:00Z' in feed('2020-01-03T00:00:00Z')
@@ -103,3 +103,52 @@ class TestCompiler(object):
         expected = '<title>My Blog</title><h1>Ammar</h1><div>Hi</div>\n<footer>Peace</footer>'
 
         assert compiler.compile(tags, src) == expected
+
+    def test_splits_template_into_literals_and_slots(self):
+        src = '$title$ costs $5 <b>$price$</b>'
+        expected = ['', '$title$', ' costs $5 <b>', '$price$', '</b>']
+        assert compiler.split_template(src) == expected
+
+    def test_compiles_template_once_for_many_posts(self):
+        template = compiler.CompiledTemplate('$title$<main>$content$</main>$title$ $missing$')
+        assert template.names == ['$title$', '$content$', '$missing$']
+        assert template.slots == [0, 1, 0, 2]
+
+        first = { 'globals': { '$title$': 'One' }, 'custom_tags': { 'content': 'a' } }
+        second = { 'globals': { '$title$': 'Two' }, 'custom_tags': { 'content': 'b' } }
+        assert compiler.compile(first, template) == 'One<main>a</main>One $missing$'
+        assert compiler.compile(second, template) == 'Two<main>b</main>Two $missing$'
+
+    def test_rebuilds_template_from_segments(self):
+        template = compiler.CompiledTemplate('<b>$x$</b>$y$$x$')
+        rebuilt = compiler.CompiledTemplate.from_segments(template.segments)
+        assert rebuilt.render_values({ '$x$': '1', '$y$': '2' }) == '<b>1</b>21'
+
+    def test_compiles_variables_at_start_and_with_changing_lengths(self):
+        variables = { '$a$': 'a much longer value', '$b$': '' }
+        src = '$a$ then $b$ then $a$'
+
+        assert compiler.compile_variables(src, variables) == 'a much longer value then  then a much longer value'
+
+    def test_collects_substring_at_start(self):
+        assert compiler.collect_substring_locations('bbbaaabbb', 'bbb') == [0, 6]
+
+    def test_streams_chunks_matching_compile(self):
+        import io
+        tags = { 'globals': { '$title$': 'T' }, 'custom_tags': { 'content': 'C' * 1000 } }
+        src = '<title>$title$</title>$content$ $missing$'
+
+        template = compiler.CompiledTemplate(src)
+        assert ''.join(template.iter_render(tags)) == compiler.compile(tags, src)
+
+        out = io.StringIO()
+        compiler.compile_to(out, tags, src)
+        assert out.getvalue() == compiler.compile(tags, src)
+
+    @pytest.mark.parametrize('html', [
+        '<script>$.get("/x")</script><h1>$title$</h1><p>$content$</p>',
+        '<p>US$5</p><h1>$title$</h1><p>$content$</p>',
+    ])
+    def test_stray_dollar_does_not_swallow_slots(self, html):
+        tags = { 'globals': { '$title$': 'T' }, 'custom_tags': { 'content': 'C' } }
+        assert compiler.compile(tags, html) == html.replace('$title$', 'T').replace('$content$', 'C')
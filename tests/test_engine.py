@@ -0,0 +1,98 @@
+import threading
+import pytest
+import blagh
+from blagh import engine
+
+POST = '''<imports>$macros$</imports>
+<globals>
+$title$ := Hello
+</globals>
+<body><convo>hi $who$</convo></body>
+<variables>
+$who$ := there
+</variables>
+'''
+
+def write(tmpdir, name, contents):
+    tmpdir.join(name).write(contents)
+
+class TestEngine(object):
+
+
+
+    # Render Tests
+
+
+
+    def test_renders_source_against_named_template(self, tmpdir):
+        write(tmpdir, 'macros.blagh', '<macros>\n$convo$ := <div>{}</div>\n</macros>')
+        write(tmpdir, 'page.html', '<h1>$title$</h1>$body$')
+
+        e = blagh.Engine(template_dir=str(tmpdir), base_dir=str(tmpdir))
+        assert e.render(POST, 'page.html') == '<h1>Hello</h1><div>hi there</div>'
+
+    def test_closes_tags_like_the_cli(self):
+        e = blagh.Engine()
+        e.add_template('page', '[$c$|$d$]')
+
+        assert e.render('<c>x</c><d><c>inner</c></d>', 'page') == '[x|<c>inner</c>]'
+
+    def test_renders_from_many_threads(self, tmpdir):
+        write(tmpdir, 'macros.blagh', '<macros>\n$convo$ := <p>{}</p>\n</macros>')
+        e = blagh.Engine(base_dir=str(tmpdir))
+        e.add_template('page', '$body$')
+
+        results = []
+        threads = [ threading.Thread(target=lambda: results.append(e.render(POST, 'page'))) for _ in range(16) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == ['<p>hi there</p>'] * 16
+        assert len(e.templates) == len(e.macro_tables) == len(e.resolver.documents) == 1
+
+    def test_caches_until_invalidated(self, tmpdir):
+        write(tmpdir, 'macros.blagh', '<macros>\n$convo$ := <p>{}</p>\n</macros>')
+        write(tmpdir, 'page.html', 'old $body$')
+        e = blagh.Engine(template_dir=str(tmpdir), base_dir=str(tmpdir))
+        e.render(POST, 'page.html')
+
+        write(tmpdir, 'page.html', 'new $body$')
+        assert e.render(POST, 'page.html') == 'old <p>hi there</p>'
+
+        e.invalidate_template('page.html')
+        assert e.render(POST, 'page.html') == 'new <p>hi there</p>'
+
+        write(tmpdir, 'macros.blagh', '<macros>\n$convo$ := <div>{}</div>\n</macros>')
+        assert e.render(POST, 'page.html') == 'new <p>hi there</p>'
+
+        e.invalidate_import(str(tmpdir.join('macros.blagh')))
+        assert e.render(POST, 'page.html') == 'new <div>hi there</div>'
+
+        # a cached import is reused without touching the disk
+        tmpdir.join('macros.blagh').remove()
+        assert e.render(POST, 'page.html') == 'new <div>hi there</div>'
+
+    def test_bounds_its_caches(self):
+        e = blagh.Engine(max_templates=2)
+        for name in 'abc':
+            e.add_template(name, name)
+
+        assert len(e.templates) == 2
+        assert e.template('c').render({}) == 'c'
+
+
+
+    # LRUCache Tests
+
+
+
+    def test_get_or_create_fills_missing_entries(self):
+        lru = engine.LRUCache(2)
+        assert lru.get_or_create('a', lambda: 1) == 1
+        assert lru.get_or_create('a', lambda: 2) == 1
+        lru['b'] = 2
+        lru.get('a')
+        lru['c'] = 3
+        assert lru.keys() == ['a', 'c']
@@ -78,6 +78,13 @@ class TestExpansion(object):
         expected = '<div> my-convo </div> <li> my-test </li> '
         assert expansion.expand_variables(variables, src) == expected
 
+    def test_expands_adjacent_variables_that_grow_contents(self):
+        variables = { '$a$': 'a much longer value', '$b$': 'B' }
+        src = '$a$$b$ $a$ $b$$c$'
+
+        expected = 'a much longer valueB a much longer value B'
+        assert expansion.expand_variables(variables, src) == expected
+
     def test_expands_macro_data_into_string(self):
         macros = { '$conversation$': '<li>{}</li>' }
         src = '<conversation>what</conversation>'
@@ -176,3 +183,111 @@ class TestExpansion(object):
 
         assert ctx['custom_tags']['content'] == expected_1
         assert ctx['custom_tags']['footer'] == expected_2
+
+    def test_expands_streamed_content_tags_lazily(self):
+        tags = iter([
+            ('variables', '$author$ := Ammar'),
+            ('macros', '$true$ := <ul>{}</ul>'),
+            ('content', '<true>$author$</true>'),
+        ])
+
+        expanded = expansion.expand_stream(tags)
+        assert next(expanded) == ('content', '<ul>Ammar</ul>')
+
+    def test_fails_for_streamed_definitions_after_content(self):
+        tags = [('content', 'hi'), ('variables', '$author$ := Ammar')]
+
+        with pytest.raises(Exception):
+            list(expansion.expand_stream(tags))
+
+    def test_orders_macros_after_their_dependencies(self):
+        macros = { '$outer$': '<div><middle>{}</middle></div>', '$middle$': '<inner>{}</inner>', '$inner$': '<p>{}</p>' }
+        table = expansion.compile_macros(macros)
+
+        assert table.order == ['inner', 'middle', 'outer']
+        assert str(table['outer']) == '<div><p>{}</p></div>'
+
+    def test_fails_for_macro_cycles(self):
+        macros = { '$a$': '<b>{}</b>', '$b$': '<c>{}</c>', '$c$': '<b>{}</b>' }
+
+        with pytest.raises(Exception) as e:
+            expansion.compile_macros(macros)
+        assert 'Macro cycle: $b$ -> $c$ -> $b$' in str(e.value)
+
+    def test_reuses_macro_table_for_identical_macros(self):
+        macros = { '$foo$': '<p>{}</p>' }
+        assert expansion.macro_table(macros) is expansion.macro_table(dict(macros))
+
+    def test_expands_nested_macros_of_the_same_name(self):
+        macros = { '$box$': '<div>{}</div>' }
+        src = '<box> a <box> b </box> c </box><box>d</box>'
+
+        expected = '<div>a <div>b</div> c</div><div>d</div>'
+        assert expansion.expand_macros(macros, src) == expected
+
+    def test_expands_deeply_nested_macros_without_recursion(self):
+        macros = { '$box$': '<i>{}</i>' }
+        depth = 5000
+        src = '<box>' * depth + 'x' + '</box>' * depth
+
+        assert expansion.expand_macros(macros, src) == '<i>' * depth + 'x' + '</i>' * depth
+
+    def test_strips_whitespace_around_each_nested_macros_data(self):
+        macros = { '$box$': '<i>{}</i>' }
+        depth = 5000
+        src = ' <box> ' * depth + 'x' + ' </box> ' * depth
+
+        assert expansion.expand_macros(macros, src) == ' <i>' + '<i>' * (depth - 1) + 'x' + '</i>' * (depth - 1) + '</i> '
+
+    def test_fails_for_unclosed_macro(self):
+        with pytest.raises(Exception):
+            expansion.expand_macros({ '$box$': '<div>{}</div>' }, '<box> a <box> b </box>')
+
+    def test_fails_for_interleaved_macros(self):
+        with pytest.raises(Exception):
+            expansion.expand_macros({ '$a$': '<p>{}</p>', '$b$': '<i>{}</i>' }, '<a><b>x</a></b>')
+
+    def test_compiles_macros_into_prefix_and_suffix(self):
+        table = expansion.compile_macros({ '$convo$': '<div class="conversation"><foo>{}</foo></div>', '$foo$': '<p>{}</p>' })
+
+        assert table['convo'].prefix == '<div class="conversation"><p>'
+        assert table['convo'].suffix == '</p></div>'
+        assert table['convo']('hi') == '<div class="conversation"><p>hi</p></div>'
+
+    def test_expands_macros_with_literal_braces(self):
+        macros = { '$styled$': '<style>p { color: red; }</style><p>{}</p><script>if (x) {}</script>' }
+        src = '<styled>hi</styled>'
+
+        expected = '<style>p { color: red; }</style><p>hi</p><script>if (x) {}</script>'
+        assert expansion.expand_macros(macros, src) == expected
+
+    def test_parallel_expansion_matches_serial(self):
+        from benchmarks import corpus
+        from blagh import lexer, parser
+        src = corpus.generate_post('64KB', tags=6, macro_depth=3)
+
+        serial = expansion.expand(parser.parse(lexer.scan(src)))
+        parallel = expansion.expand(parser.parse(lexer.scan(src)), workers=2, threshold=0)
+
+        assert list(parallel.custom_tags.items()) == list(serial.custom_tags.items())
+
+    def test_parallel_expansion_reports_failing_tag(self):
+        tags = { 'variables': {}, 'macros': { '$box$': '<i>{}</i>' }, 'custom_tags': { 'a': 'fine', 'b': '<box>unclosed' } }
+
+        with pytest.raises(Exception) as e:
+            expansion.expand(tags, workers=2, threshold=0)
+        assert 'in tag "b"' in str(e.value)
+
+    @pytest.mark.parametrize('workers', [None, 2])
+    def test_reports_source_position_of_macro_errors(self, workers):
+        from blagh import lexer, parser
+        src = '<macros>\n$box$ := <div>{}</div>\n</macros>\n<content>\n  hello\n     there\n  <box>\n    unclosed\n</content>\n<other></box></other>'
+        doc = parser.parse(lexer.tokenize(src))
+
+        with pytest.raises(Exception) as e:
+            expansion.expand(doc, workers=workers, threshold=0)
+        assert str(e.value) == 'Improperly closed macro "box" at line 7, col 3 (in tag "content" at line 4, col 10)'
+
+        with pytest.raises(Exception) as e:
+            expansion.expand({ 'macros': { '$box$': '<div>{}</div>' }, 'custom_tags': { 'c': 'a\n\n  </box>' } })
+        assert str(e.value) == 'Unexpected closing macro "box" at offset 5 (in tag "c")'
@@ -0,0 +1,59 @@
+import os
+import pytest
+from blagh import lexer, parser, expansion, compiler, tool
+from benchmarks import corpus, run
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+class TestFull(object):
+
+
+
+    # End-to-End Tests
+
+
+
+    def test_compiles_example_post(self):
+        src = tool.load_file(os.path.join(EXAMPLES, 'my-blog-post.blagh'))
+        template = tool.load_file(os.path.join(EXAMPLES, 'my-template.html'))
+
+        html = compiler.compile(expansion.expand(parser.parse(lexer.scan(src))), template)
+        assert '<title>My First Blog Post - Walt Whitman</title>' in html
+        assert '<div class="conversation"><p><p> What do you think, ol\' chap? </p></p></div>' in html
+        assert '<div class="credits"><p> Fin </p></div>' in html
+
+    def test_compiles_generated_post(self):
+        src = corpus.generate_post('4KB', tags=3, variables=5, variable_density=0.2, macro_depth=3)
+        template = corpus.generate_template(3)
+
+        html = compiler.compile(expansion.expand(parser.parse(lexer.scan(src))), template)
+        assert '<title>Synthetic Post 0 - Benchmark</title>' in html
+        assert '<div class="m2"><div class="m1"><p class="m0">' in html
+        assert '$v' not in html
+        assert '<macro_' not in html
+
+
+
+    # Benchmark Harness Tests
+
+
+
+    def test_generates_post_of_requested_size(self):
+        src = corpus.generate_post('20KB', tags=4)
+        assert 20 * 1024 <= len(src) < 24 * 1024
+        assert sorted(lexer.scan(src)) == ['globals', 'macros', 'tag0', 'tag1', 'tag2', 'tag3', 'variables']
+
+    def test_flags_only_regressions_over_threshold(self):
+        baseline = { 'results': [ { 'stage': 'lex', 'size': '1KB', 'seconds': 1.0 }, { 'stage': 'parse', 'size': '1KB', 'seconds': 1.0 } ] }
+        results = [ { 'stage': 'lex', 'size': '1KB', 'seconds': 1.2 }, { 'stage': 'parse', 'size': '1KB', 'seconds': 1.5 } ]
+
+        regressions = run.compare(results, baseline, 0.25)
+        assert [r['stage'] for r in regressions] == ['parse']
+
+    def test_times_only_the_selected_stages(self, monkeypatch):
+        monkeypatch.setattr(run, 'end_to_end_timer', lambda *args: pytest.fail('end_to_end was not selected'))
+        options = run.parse_arguments(['--sizes', '1KB,2KB', '--stages', 'parse,lex', '--repeat', '2', '--min-time', '0.001'])
+
+        results = run.bench(options)
+        assert [ (r['stage'], r['size']) for r in results ] == [('lex', '1KB'), ('parse', '1KB'), ('lex', '2KB'), ('parse', '2KB')]
+        assert all(r['seconds'] > 0 for r in results)
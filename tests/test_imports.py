@@ -0,0 +1,65 @@
+import pytest
+from blagh import imports, parser, lexer
+
+def write(tmpdir, name, src):
+    tmpdir.join(name + '.blagh').write(src)
+
+def parse(src):
+    return parser.parse(lexer.tokenize(src))
+
+class TestImports(object):
+
+
+
+    # Import Resolution Tests
+
+
+
+    def test_parses_import_names_in_order(self):
+        assert parser.parse_imports('\n  $macros$\n  $shared/globals$\n') == ['macros', 'shared/globals']
+
+    def test_merges_imported_definitions(self, tmpdir):
+        write(tmpdir, 'macros', '<macros>\n$convo$ := <div>{}</div>\n</macros>\n<content>ignored</content>')
+        write(tmpdir, 'globals', '<globals>\n$slug$ := my-post\n</globals>')
+
+        doc = parse('<imports>\n$macros$\n$globals$\n</imports>\n<variables>\n$x$ := y\n</variables>')
+        imports.Resolver().resolve(doc, str(tmpdir))
+
+        assert doc.macros == { '$convo$': '<div>{}</div>' }
+        assert doc.globals == { '$slug$': 'my-post' }
+        assert doc.variables == { '$x$': 'y' }
+        assert doc.custom_tags == {}
+
+    def test_parses_each_import_once(self, tmpdir):
+        write(tmpdir, 'macros', '<macros>\n$convo$ := <div>{}</div>\n</macros>')
+        resolver = imports.Resolver()
+
+        for _ in range(3):
+            resolver.resolve(parse('<imports>$macros$</imports>'), str(tmpdir))
+
+        assert len(resolver.documents) == 1
+
+    def test_merges_shared_imports_once(self, tmpdir):
+        write(tmpdir, 'base', '<variables>\n$x$ := y\n</variables>')
+        write(tmpdir, 'a', '<imports>$base$</imports>\n<globals>\n$a$ := 1\n</globals>')
+        write(tmpdir, 'b', '<imports>$base$</imports>\n<globals>\n$b$ := 2\n</globals>')
+
+        doc = imports.Resolver().resolve(parse('<imports>$a$ $b$</imports>'), str(tmpdir))
+        assert doc.variables == { '$x$': 'y' }
+        assert doc.globals == { '$a$': '1', '$b$': '2' }
+
+    def test_fails_for_conflicting_names(self, tmpdir):
+        write(tmpdir, 'globals', '<globals>\n$slug$ := my-post\n</globals>')
+        doc = parse('<imports>$globals$</imports>\n<globals>\n$slug$ := another\n</globals>')
+
+        with pytest.raises(Exception) as e:
+            imports.Resolver().resolve(doc, str(tmpdir))
+        assert 'Global "$slug$"' in str(e.value)
+
+    def test_fails_for_import_cycles(self, tmpdir):
+        write(tmpdir, 'a', '<imports>$b$</imports>')
+        write(tmpdir, 'b', '<imports>$a$</imports>')
+
+        with pytest.raises(Exception) as e:
+            imports.Resolver().resolve(parse('<imports>$a$</imports>'), str(tmpdir))
+        assert 'Import cycle' in str(e.value)
@@ -119,3 +119,65 @@ class TestLexer(object):
         assert 'globals' in tags
         assert 'macros' in tags
         assert 'content' in tags
+
+    def test_parses_a_tag_with_attributes(self):
+        src = '<tag class="x">this is my program</tag>'
+        tags = lexer.scan(src)
+        assert tags['tag'] == 'this is my program'
+
+    def test_fails_for_unclosed_tag(self):
+        src = '<tag>this is my program</another>'
+        with pytest.raises(Exception):
+            lexer.scan(src)
+
+    def test_closes_tag_at_its_last_closing_tag(self):
+        src = '<tag>one</tag>\n<other>two</other>\n<tag>three</tag>'
+        tags = lexer.scan(src)
+        assert tags['tag'] == 'one</tag>\n<other>two</other>\n<tag>three'
+
+    def test_streams_tags_from_a_file_object(self):
+        import io
+        src = '<globals>\n$x$ := y\n</globals>\n<content><content>a</content> b</content>\n'
+        tags = [tuple(token) for token in lexer.scan_stream(io.StringIO(src), chunk_size=3)]
+        assert tags == [('globals', '\n$x$ := y\n'), ('content', '<content>a</content> b')]
+
+    def test_streams_same_tags_as_scan(self):
+        import io
+        src = '<tag>this is my program</tag>\n<another href="#">hi <b>there</b></another>'
+        streamed = dict(lexer.scan_stream(io.StringIO(src), chunk_size=5))
+        assert streamed == lexer.scan(src)
+
+    def test_streams_same_tags_for_any_chunk_size(self):
+        import io
+        for src in ['<x<y</i>', '<a<b>one</b>', '<a>one<a<b></a>']:
+            scans = set()
+            for chunk_size in range(1, len(src) + 2):
+                try:
+                    scans.add(tuple(tuple(t) for t in lexer.scan_stream(io.StringIO(src), chunk_size=chunk_size)))
+                except Exception as e:
+                    scans.add(str(e))
+            assert len(scans) == 1, src
+
+    def test_fails_for_unclosed_streamed_tag(self):
+        import io
+        with pytest.raises(Exception):
+            list(lexer.scan_stream(io.StringIO('<tag>never closed')))
+
+    def test_tokenizes_tags_with_source_positions(self):
+        src = '<tag>one</tag>\n  <another>\ntwo</another>'
+        tokens = list(lexer.tokenize(src))
+        assert [(t.tag, t.start, t.end, t.line, t.col) for t in tokens] == [('tag', 5, 8, 1, 6), ('another', 26, 30, 2, 12)]
+        assert tokens[1].text == '\ntwo'
+        assert tokens[1].locate(1) == (3, 1)
+
+    def test_streamed_tokens_match_tokenized_positions(self):
+        import io
+        src = '<tag>one</tag>\n  <another>\ntwo</another>'
+        streamed = [(t.tag, t.text, t.line, t.col) for t in lexer.scan_stream(io.StringIO(src), chunk_size=4)]
+        tokenized = [(t.tag, t.text, t.line, t.col) for t in lexer.tokenize(src)]
+        assert streamed == tokenized
+
+    def test_reports_position_of_unclosed_tag(self):
+        with pytest.raises(Exception) as e:
+            lexer.scan('\n\n  <tag>never closed')
+        assert 'line 3, col 3' in str(e.value)
@@ -0,0 +1,94 @@
+import os
+import gzip
+import pytest
+from blagh import output, tool
+
+class TestOutput(object):
+
+
+
+    # Writer Tests
+
+
+
+    def test_writes_into_new_directories(self, tmpdir):
+        writer = output.Writer()
+        path = tmpdir.join('a', 'b', 'index.html')
+
+        assert writer.write(str(path), ['<p>', 'hi', '</p>'])
+        assert path.read() == '<p>hi</p>'
+        assert [ f for f in os.listdir(str(tmpdir.join('a', 'b'))) ] == ['index.html']
+
+    def test_skips_unchanged_files(self, tmpdir):
+        writer = output.Writer()
+        path = str(tmpdir.join('index.html'))
+
+        writer.write_text(path, 'same')
+        os.utime(path, (0, 0))
+
+        assert not writer.write_text(path, 'same')
+        assert os.path.getmtime(path) == 0
+        assert writer.write_text(path, 'different')
+        assert writer.summary() == 'wrote 2, unchanged 1'
+
+    def test_leaves_original_when_rendering_fails(self, tmpdir):
+        path = tmpdir.join('index.html')
+        path.write('original')
+
+        def chunks():
+            yield 'partial'
+            raise Exception('render failed')
+
+        with pytest.raises(Exception):
+            output.Writer().write(str(path), chunks())
+        assert path.read() == 'original'
+        assert os.listdir(str(tmpdir)) == ['index.html']
+
+    def test_creates_files_with_the_process_umask(self, tmpdir):
+        previous = os.umask(0o027)
+        try:
+            assert output.Writer().write_text(str(tmpdir.join('index.html')), 'x')
+            assert os.umask(0o027) == 0o027
+        finally:
+            os.umask(previous)
+
+        assert os.stat(str(tmpdir.join('index.html'))).st_mode & 0o777 == 0o640
+
+    def test_rewrites_existing_post_directory(self, tmpdir):
+        dirname = str(tmpdir.join('post'))
+        assert tool.write_blog_post('<p>one</p>', dirname)
+        assert not tool.write_blog_post('<p>one</p>', dirname)
+        assert tool.write_blog_post('<p>two</p>', dirname)
+        assert tmpdir.join('post', 'index.html').read() == '<p>two</p>'
+
+    def test_counts_batched_writes(self, tmpdir):
+        writer = output.Writer()
+        files = [ (str(tmpdir.join(str(n), 'index.html')), [str(n)]) for n in range(3) ]
+
+        assert writer.write_many(files) == 3
+        assert writer.write_many(files) == 0
+        assert (writer.written, writer.skipped) == (3, 3)
+
+    def test_writes_gzip_variants(self, tmpdir):
+        writer = output.Writer(compress=True)
+        path = str(tmpdir.join('index.html'))
+
+        assert writer.write(path, ['<p>', 'hi', '</p>'])
+        assert gzip.decompress(tmpdir.join('index.html.gz').read_binary()) == b'<p>hi</p>'
+        assert not writer.write(path, ['<p>hi</p>'])
+
+        assert output.Writer().write_text(path, 'changed')
+        assert not tmpdir.join('index.html.gz').exists()
+
+
+
+    # Minify Tests
+
+
+
+    def test_minifies_whitespace(self):
+        assert output.minify('\n<div>\n    <p>a   b</p>\n</div>\n') == '<div> <p>a b</p> </div>'
+
+    def test_preserves_pre_textarea_and_script(self):
+        html = '<pre>  a\n  b</pre>  <TEXTAREA rows="2">x\n\ny</TEXTAREA>\n<script>if (a)\n  b()</script>'
+        assert output.minify(html) == '<pre>  a\n  b</pre> <TEXTAREA rows="2">x\n\ny</TEXTAREA> <script>if (a)\n  b()</script>'
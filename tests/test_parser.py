@@ -84,3 +84,36 @@ class TestParser(object):
         res = parser.validate_and_parse_tag(ctx, 'foo', custom)
         assert 'custom_tags' in res
         assert 'foo' in res['custom_tags']
+
+    def test_reports_location_of_invalid_tag(self):
+        from blagh import lexer
+        src = '<globals>\n$x$ := y\n</globals>\n<macros>\n$convo$ := <div></div>\n</macros>'
+
+        with pytest.raises(Exception) as e:
+            parser.parse(lexer.tokenize(src))
+        assert 'in tag "macros" at line 4, col 9' in str(e.value)
+
+    def test_ignores_lines_with_more_than_one_assignment(self):
+        parsed = parser.parse_assignments('$a$ := b := c\n$d$ := e\njust text')
+        assert repr(parsed) == repr([['$d$', 'e']])
+
+    def test_tracks_assignment_lines(self):
+        assignments = list(parser.iter_assignments('\n$a$ := b\n\n\t$c$ := d\n', line=10))
+        assert [(a.name, a.value, a.line) for a in assignments] == [('$a$', 'b', 11), ('$c$', 'd', 13)]
+
+    def test_reports_line_of_duplicate_variable(self):
+        from blagh import lexer
+        src = '<variables>\n$x$ := y\n$x$ := z\n</variables>'
+
+        with pytest.raises(Exception) as e:
+            parser.parse(lexer.tokenize(src))
+        assert 'Variable "$x$" already in dict at line 3' in str(e.value)
+
+    def test_parses_into_document(self):
+        doc = parser.parse({ 'globals': '$t$ := T', 'macros': '$m$ := <b>{}</b>', 'content': 'hi' })
+        assert isinstance(doc, parser.Document)
+        assert doc.globals == { '$t$': 'T' }
+        assert doc.macros == { '$m$': '<b>{}</b>' }
+        assert doc.variables == {}
+        assert doc.custom_tags == { 'content': 'hi' }
+        assert doc['custom_tags'] is doc.custom_tags
@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+import pytest
+from blagh import profiling, lexer, tool
+
+class TestProfiling(object):
+
+
+
+    # Tracing Tests
+
+
+
+    def test_trace_skips_formatting_when_disabled(self):
+        calls = []
+        logger = logging.getLogger('TraceTest')
+        logger.setLevel(logging.INFO)
+
+        class Expensive(object):
+            def __str__(self):
+                calls.append('formatted')
+                return 'expensive'
+
+        profiling.trace(logger, '%s', Expensive())
+        assert calls == []
+
+    def test_trace_formats_when_enabled(self, caplog):
+        with caplog.at_level(logging.DEBUG, logger='TraceTest'):
+            profiling.trace(logging.getLogger('TraceTest'), 'value: %s', 'expensive')
+
+        assert 'value: expensive' in caplog.text
+
+    def test_lexer_traces_tokens_at_debug(self, caplog):
+        with caplog.at_level(logging.DEBUG, logger='Lexer'):
+            lexer.scan('<a>x</a>')
+
+        assert "Token('a'" in caplog.text
+
+
+
+    # Profiler Tests
+
+
+
+    def test_stages_are_noops_when_disabled(self):
+        items = [1, 2]
+        assert profiling.iterate('lex', items) is items
+        with profiling.stage('lex'):
+            pass
+
+    def test_nested_stages_report_self_time(self):
+        profiler = profiling.enable()
+        try:
+            with profiling.stage('parse'):
+                assert list(profiling.iterate('lex', range(3))) == [0, 1, 2]
+                data = [ bytearray(1024) for _ in range(64) ]
+        finally:
+            profiling.disable()
+
+        report = profiler.report()
+        assert report['lex']['calls'] == 4
+        assert report['parse']['calls'] == 1
+        assert report['parse']['bytes'] >= 64 * 1024
+        assert report['expand'] == { 'calls': 0, 'seconds': 0.0, 'bytes': 0 }
+        assert profiling.PROFILER is None
+
+    def test_peaks_exclude_nested_stages(self):
+        profiler = profiling.enable()
+        try:
+            with profiling.stage('parse'):
+                data = bytearray(1024 * 1024)
+                del data
+                with profiling.stage('expand'):
+                    data = bytearray(4 * 1024 * 1024)
+                    del data
+        finally:
+            profiling.disable()
+
+        report = profiler.report()
+        assert 1024 * 1024 <= report['parse']['bytes'] < 2 * 1024 * 1024
+        assert report['expand']['bytes'] >= 4 * 1024 * 1024
+
+    def test_profile_flag_prints_json(self, tmpdir, capsys):
+        post = tmpdir.join('post.blagh')
+        post.write('<globals>\n$title$ := Hi\n</globals>\n<body>hello</body>\n')
+        template = tmpdir.join('template.html')
+        template.write('<h1>$title$</h1>$body$')
+
+        cwd = os.getcwd()
+        tmpdir.chdir()
+        try:
+            tool.main(['-f', str(post), '-t', str(template), '--no-cache', '--profile', 'json'])
+        finally:
+            os.chdir(cwd)
+
+        report = json.loads(capsys.readouterr().out)
+        assert sorted(report) == sorted(profiling.STAGES)
+        assert all(report[stage]['calls'] > 0 for stage in profiling.STAGES)
@@ -0,0 +1,103 @@
+import os
+import json
+import pytest
+from blagh import build, search, tool
+
+TEMPLATE = '$content$'
+
+SITE = {
+    'apples.blagh': '<globals>\n$title$ := Apples\n</globals>\n<content><p>Apples &amp; apricots, apples!</p></content>',
+    'bananas.blagh': '<globals>\n$title$ := Bananas\n</globals>\n<content>bananas and apricots</content>',
+    'macros.blagh': '<macros>\n$box$ := <div>{}</div>\n</macros>',
+}
+
+def shard(out, prefix):
+    return json.loads(out.join('search', prefix + '.json').read_text('utf-8'))
+
+def lookup(out, term):
+    docs = json.loads(out.join('search', 'docs.json').read())
+    flat = shard(out, term[:search.PREFIX_LENGTH]).get(term, [])
+    return { docs[str(d)][1]: count for d, count in zip(flat[::2], flat[1::2]) }
+
+class TestSearch(object):
+
+
+
+    # Tokenize Tests
+
+
+
+    def test_tokenizes_text_outside_markup(self):
+        assert list(search.tokenize('<p class="x">Héllo, <b>World</b> &amp; a 42</p>')) == ['héllo', 'world', '42']
+
+    def test_counts_terms_across_tags(self):
+        assert search.count_terms({ 'a': 'one two', 'b': 'two' }) == { 'one': 1, 'two': 2 }
+
+
+
+    # Index Tests
+
+
+
+    def test_build_writes_sharded_index(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        build.build(str(src), str(tmpdir.join('template.html')), str(out), jobs=1, search=True)
+
+        assert lookup(out, 'apples') == { 'Apples': 2 }
+        assert lookup(out, 'apricots') == { 'Apples': 1, 'Bananas': 1 }
+        assert sorted(os.listdir(str(out.join('search')))) == ['an.json', 'ap.json', 'ba.json', 'docs.json']
+
+    def test_updates_only_touched_shards(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        template = str(tmpdir.join('template.html'))
+        build.build(str(src), template, str(out), jobs=1, incremental=True, search=True)
+
+        for name in os.listdir(str(out.join('search'))):
+            os.utime(str(out.join('search', name)), (0, 0))
+
+        src.join('bananas.blagh').write('<globals>\n$title$ := Bananas\n</globals>\n<content>bananas and cherries</content>')
+        build.build(str(src), template, str(out), jobs=1, incremental=True, search=True)
+
+        mtimes = { name: os.path.getmtime(str(out.join('search', name))) for name in os.listdir(str(out.join('search'))) }
+        assert mtimes['ch.json'] > 0 and mtimes['ap.json'] > 0
+        assert mtimes['ba.json'] == mtimes['an.json'] == mtimes['docs.json'] == 0
+        assert lookup(out, 'apricots') == { 'Apples': 1 }
+        assert lookup(out, 'cherries') == { 'Bananas': 1 }
+
+        src.join('apples.blagh').remove()
+        build.build(str(src), template, str(out), jobs=1, incremental=True, search=True)
+        assert not out.join('search', 'ap.json').exists()
+        assert list(json.loads(out.join('search', 'docs.json').read()).values()) == [['bananas', 'Bananas']]
+
+    def test_catches_up_after_builds_without_search(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        template = str(tmpdir.join('template.html'))
+        build.build(str(src), template, str(out), jobs=1, incremental=True)
+
+        results = build.build(str(src), template, str(out), jobs=1, incremental=True, search=True)
+        assert { r['status'] for r in results } == { 'unchanged' }
+        assert lookup(out, 'bananas') == { 'Bananas': 1 }
+
+    def test_reindexes_everything_when_state_is_lost(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        src.join('zebra.blagh').write('<globals>\n$title$ := Zebra\n</globals>\n<content>zebras</content>')
+        out = tmpdir.join('out')
+        template = str(tmpdir.join('template.html'))
+        build.build(str(src), template, str(out), jobs=1, incremental=True, search=True)
+
+        out.join(search.STATE).remove()
+        src.join('zebra.blagh').remove()
+        build.build(str(src), template, str(out), jobs=1, incremental=True, search=True)
+
+        assert not out.join('search', 'ze.json').exists()
+        assert lookup(out, 'apricots') == { 'Apples': 1, 'Bananas': 1 }
+        assert sorted(title for _, title in json.loads(out.join('search', 'docs.json').read()).values()) == ['Apples', 'Bananas']
+
+    def test_async_cli_builds_index(self, tmpdir, make_site, capsys):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        tool.main(['build', str(src), '-t', str(tmpdir.join('template.html')), '-o', str(out), '-j', '2', '--async', '--search', '--no-cache'])
+        assert lookup(out, 'apricots') == { 'Apples': 1, 'Bananas': 1 }
@@ -0,0 +1,75 @@
+import threading
+import urllib.error
+import urllib.request
+import pytest
+from blagh import serve
+
+@pytest.fixture
+def site(tmpdir, make_site):
+    src = make_site({
+        'macros.blagh': '<macros>\n$box$ := <div>{}</div>\n</macros>',
+        'first-post.blagh': '<imports>$macros$</imports>\n<content><box>one</box></content>',
+    }, '<main>$content$</main>')
+
+    server = serve.make_server(serve.Site(str(src), str(tmpdir.join('template.html'))), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield src, 'http://127.0.0.1:{port}'.format(port=server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def get(url, etag=None):
+    request = urllib.request.Request(url, headers={ 'If-None-Match': etag } if etag else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers.get('ETag'), response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get('ETag'), e.read().decode('utf-8')
+
+class TestServe(object):
+
+
+
+    # Preview Server Tests
+
+
+
+    def test_renders_posts_with_etags(self, site):
+        src, url = site
+        status, etag, body = get(url + '/first-post/')
+        assert status == 200
+        assert body == '<main><div>one</div></main>'
+        assert etag
+
+        assert get(url + '/first-post/', etag)[0] == 304
+        assert get(url + '/missing/')[0] == 404
+        assert 'first-post' in get(url + '/')[2]
+
+    def test_rerenders_when_an_import_changes(self, site):
+        src, url = site
+        _, etag, _ = get(url + '/first-post/')
+
+        src.join('macros.blagh').write('<macros>\n$box$ := <p>{}</p>\n</macros>')
+        status, new_etag, body = get(url + '/first-post/', etag)
+        assert status == 200
+        assert new_etag != etag
+        assert body == '<main><p>one</p></main>'
+
+    def test_serves_concurrent_requests(self, site):
+        src, url = site
+        bodies = []
+        threads = [ threading.Thread(target=lambda: bodies.append(get(url + '/first-post/')[2])) for _ in range(8) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert bodies == ['<main><div>one</div></main>'] * 8
+
+    def test_evicts_least_recently_used_pages(self):
+        pages = serve.PageCache(max_pages=2)
+        pages.put('a', 1)
+        pages.put('b', 2)
+        pages.get('a')
+        pages.put('c', 3)
+        assert (pages.get('a'), pages.get('b'), pages.get('c')) == (1, None, 3)
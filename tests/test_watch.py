@@ -0,0 +1,96 @@
+import os
+import pytest
+from blagh import watch, build
+
+TEMPLATE = '<main>$content$</main>'
+
+SITE = {
+    'macros.blagh': '<macros>\n$box$ := <div>{}</div>\n</macros>',
+    'boxed.blagh': '<imports>$macros$</imports>\n<content><box>one</box></content>',
+    'plain.blagh': '<content>two</content>',
+}
+
+def touch(path, src):
+    # bump the mtime explicitly so fast successive writes are always seen
+    path.write(src)
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+def rebuilt(results):
+    return sorted(os.path.basename(r['post']) for r in results if r['status'] == 'built')
+
+class TestWatch(object):
+
+
+
+    # Change Detection Tests
+
+
+
+    def test_rebuilds_only_affected_posts(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        watcher = watch.Watcher(str(src), str(tmpdir.join('template.html')), str(out))
+        build.init_worker(watcher.template_path, None)
+
+        assert rebuilt(watcher.poll()) == ['boxed.blagh', 'plain.blagh']
+        assert watcher.poll() == []
+
+        touch(src.join('plain.blagh'), '<content>three</content>')
+        assert rebuilt(watcher.poll()) == ['plain.blagh']
+        assert out.join('plain', 'index.html').read() == '<main>three</main>'
+
+        touch(src.join('macros.blagh'), '<macros>\n$box$ := <p>{}</p>\n</macros>')
+        assert rebuilt(watcher.poll()) == ['boxed.blagh']
+        assert out.join('boxed', 'index.html').read() == '<main><p>one</p></main>'
+
+    def test_rebuilds_everything_when_template_changes(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        watcher = watch.Watcher(str(src), str(tmpdir.join('template.html')), str(out))
+        build.init_worker(watcher.template_path, None)
+        watcher.poll()
+
+        touch(tmpdir.join('template.html'), '<article>$content$</article>')
+        results = watcher.poll()
+        assert rebuilt(results) == ['boxed.blagh', 'plain.blagh']
+        assert out.join('plain', 'index.html').read() == '<article>two</article>'
+        assert all('latency' in r and r['seconds'] >= 0 for r in results)
+
+    def test_retries_failed_posts_on_any_change(self, tmpdir, make_site):
+        src = make_site({ 'p.blagh': '<imports>$m$</imports>\n<content><box>one</box></content>' }, TEMPLATE)
+        out = tmpdir.join('out')
+        watcher = watch.Watcher(str(src), str(tmpdir.join('template.html')), str(out))
+        build.init_worker(watcher.template_path, None)
+
+        assert [ r['status'] for r in watcher.poll() ] == ['failed']
+
+        touch(src.join('m.blagh'), '<macros>\n$box$ := <div>{}</div>\n</macros>')
+        statuses = { os.path.basename(r['post']): r['status'] for r in watcher.poll() }
+        assert statuses == { 'm.blagh': 'skipped', 'p.blagh': 'built' }
+        assert out.join('p', 'index.html').read() == '<main><div>one</div></main>'
+        assert watcher.failed == set()
+
+    def test_keeps_last_good_template_until_it_loads_again(self, tmpdir, make_site):
+        src = make_site(SITE, TEMPLATE)
+        out = tmpdir.join('out')
+        watcher = watch.Watcher(str(src), str(tmpdir.join('template.html')), str(out))
+        build.init_worker(watcher.template_path, None)
+        watcher.poll()
+
+        tmpdir.join('template.html').remove()
+        results = watcher.poll()
+        assert [ (r['post'], r['status']) for r in results ] == [(watcher.template_path, 'failed')]
+        assert 'template.html' in watch.describe(results[0])
+
+        # other edits still render with the last good template, and retry loading it
+        touch(src.join('plain.blagh'), '<content>three</content>')
+        assert [ r['status'] for r in watcher.poll() ] == ['failed', 'built']
+        assert out.join('plain', 'index.html').read() == '<main>three</main>'
+
+        touch(tmpdir.join('template.html'), '<article>$content$</article>')
+        assert rebuilt(watcher.poll()) == ['boxed.blagh', 'plain.blagh']
+        assert out.join('plain', 'index.html').read() == '<article>three</article>'
+
+    def test_falls_back_to_polling(self):
+        assert isinstance(watch.make_waiter(poll=True), watch.PollingWaiter)